@@ -0,0 +1,573 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+
+# Batch migration of many files as a three-stage pipeline: reader threads prefetch the source
+# archives, a pool of worker processes migrates the XML, and writer threads assemble and write the
+# output archives. The stages are connected by bounded queues, so a slow stage applies
+# backpressure to the stages before it instead of letting data pile up in memory.
+#
+# Optionally, files are scheduled largest-first against a global memory budget, using an estimate
+# of each file's memory cost taken from the zip central directory, and each file is migrated under
+# per-file memory and time limits. Files that exceed the limits (or whose worker process dies) are
+# reported as killed rather than taking the whole run down with them.
+#
+# Members copied unchanged into the output archives are deduplicated across files through a shared
+# cache of compressed members (see dedup.py). Files that were exported by this tool at the target
+# version with every applicable migrator (see provenance.py) are copied unchanged.
+#
+# Sources and destinations may be in any storage (see storage.py), e.g. an S3 bucket: the reader
+# threads then prefetch whole objects ahead of the migration stage, memory estimates read only the
+# central directories, and the writer threads stream each output archive to its destination as it
+# is assembled.
+
+import io
+import os
+import queue
+import signal
+import threading
+import time
+import zipfile
+from collections import Counter
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, NamedTuple, Optional, Tuple, Type
+
+try:
+    import resource
+except ImportError:  # Not available on Windows, where per-file memory limits are not enforced
+    resource = None
+
+from packaging.version import Version
+
+from .dedup import DedupStats, MemberCache
+from .migrate import Migrate, discover_migrators, write_archives
+from .migrator import Migrator
+from .profiling import SamplingProfiler, merge, stage
+from .provenance import is_up_to_date
+from .storage import LOCAL, Storage
+
+
+class BatchItem(NamedTuple):
+    source: str
+    destination: str
+
+
+class FileResult(NamedTuple):
+    source: str
+    destination: str
+    error: Optional[str] = None
+    killed: bool = False
+    skipped: bool = False
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+class StageStats:
+    """Time spent working (as opposed to waiting) by the workers of one pipeline stage."""
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.items = 0
+        self.busy = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float):
+        with self._lock:
+            self.items += 1
+            self.busy += seconds
+
+    def utilization(self, elapsed: float) -> float:
+        """Fraction of the available worker time that was spent working."""
+        return self.busy / (elapsed * self.workers) if elapsed > 0 else 0.0
+
+
+class QueueStats:
+    """Depth of a queue, sampled each time an entry is taken from it."""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.samples = 0
+        self.total = 0
+        self.max = 0
+        self._lock = threading.Lock()
+
+    def sample(self, depth: int):
+        with self._lock:
+            self.samples += 1
+            self.total += depth
+            self.max = max(self.max, depth)
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.samples if self.samples else 0.0
+
+
+# Rough ratio between the size of an XML document and the memory used by its parsed ElementTree
+XML_MEMORY_FACTOR = 10
+
+# Default size of the cache of compressed members shared by the output archives
+DEDUP_CACHE_SIZE = 256 * 1024 * 1024
+
+# Attempts made at migrating a file whose worker process died, before giving up on it. The process
+# may have died because of another file in the same pool, so the later attempts are made in a
+# worker process of the file's own.
+MAX_ATTEMPTS = 2
+
+
+class TimeLimitExceeded(Exception):
+    """Raised in a worker process when migrating a file takes longer than the per-file limit."""
+
+
+def estimate_memory(freecad_file: str, storage: Storage = LOCAL) -> int:
+    """Estimate the peak memory needed to migrate a file in the batch pipeline, from the sizes
+    recorded in its zip central directory (only the directory is read, not the members)."""
+    size = storage.size(freecad_file)
+    try:
+        with storage.open_read(freecad_file) as f, zipfile.ZipFile(f, "r") as z:
+            xml_size = sum(
+                info.file_size
+                for info in z.infolist()
+                if info.filename in ("Document.xml", "GuiDocument.xml")
+            )
+    except (OSError, zipfile.BadZipFile):
+        xml_size = 0
+    # The raw archive is held by the pipeline and copied to the worker process
+    return 2 * size + XML_MEMORY_FACTOR * xml_size
+
+
+class MemoryBudget:
+    """Admit files as long as the sum of their estimated memory costs stays within a limit. A file
+    whose estimate exceeds the whole budget is admitted once nothing else is in flight. A limit of
+    None admits everything."""
+
+    def __init__(self, limit: Optional[int]):
+        self.limit = limit
+        self.in_use = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, amount: int):
+        if self.limit is None:
+            return
+        with self._condition:
+            self._condition.wait_for(lambda: self.in_use == 0 or self.in_use + amount <= self.limit)
+            self.in_use += amount
+
+    def release(self, amount: int):
+        if self.limit is None:
+            return
+        with self._condition:
+            self.in_use -= amount
+            self._condition.notify_all()
+
+
+class BatchReport(NamedTuple):
+    results: List[FileResult]
+    elapsed: float
+    stages: Dict[str, StageStats]
+    queues: Dict[str, QueueStats]
+    profile: Optional[Counter] = None
+    dedup: Optional[DedupStats] = None
+
+    def summary(self) -> str:
+        failed = sum(1 for result in self.results if not result.ok)
+        killed = sum(1 for result in self.results if result.killed)
+        skipped = sum(1 for result in self.results if result.skipped)
+        lines = [
+            f"Migrated {len(self.results) - failed} of {len(self.results)} file(s) "
+            f"in {self.elapsed:.2f}s, {failed} failed ({killed} killed for exceeding limits)"
+        ]
+        if skipped:
+            lines.append(f"  {skipped} file(s) were already up to date and copied unchanged")
+        for name, stage_stats in self.stages.items():
+            lines.append(
+                f"  {name:<8} {stage_stats.workers:>3} worker(s), {stage_stats.items:>6} item(s), "
+                f"{100 * stage_stats.utilization(self.elapsed):5.1f}% utilized"
+            )
+        for name, queue_stats in self.queues.items():
+            lines.append(
+                f"  {name:<8} queue depth mean {queue_stats.mean:.1f}, max {queue_stats.max} "
+                f"of {queue_stats.capacity}"
+            )
+        if self.dedup is not None and self.dedup.members:
+            lines.append(
+                f"  {self.dedup.duplicates} of {self.dedup.members} copied member(s) were "
+                f"duplicates (dedup ratio {self.dedup.ratio:.2f}), "
+                f"{self.dedup.duplicate_bytes / (1024 * 1024):.1f} MB written from the cache"
+            )
+        return "\n".join(lines)
+
+
+def _address_space() -> int:
+    """The current size of this process's address space, where it can be determined."""
+    try:
+        with open("/proc/self/statm", "r") as statm:
+            return int(statm.read().split()[0]) * resource.getpagesize()
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def _raise_time_limit_exceeded(signum, frame):
+    raise TimeLimitExceeded()
+
+
+# The migrators available in a worker process, discovered once when the process starts
+_worker_migrators: Optional[List[Type[Migrator]]] = None
+
+
+def _init_worker():
+    global _worker_migrators
+    _worker_migrators = discover_migrators()
+
+
+def _migrate_in_worker(
+    data: bytes,
+    target_version: Version,
+    memory_limit: Optional[int] = None,
+    time_limit: Optional[float] = None,
+    profile: bool = False,
+) -> Tuple[Dict[str, bytes], float, Optional[Counter]]:
+    """Migrate an FCStd archive held in memory, returning the migrated members (the serialized
+    Document.xml and GuiDocument.xml, and any transformed binary members), the time taken and, if
+    requested, the profiler samples. Where the platform allows it, the migration may use at most
+    memory_limit additional bytes of address space and take at most time_limit seconds."""
+    start = time.perf_counter()
+    profiler = SamplingProfiler() if profile else None
+    if profiler is not None:
+        profiler.start()
+    previous_memory_limit = None
+    if memory_limit and resource is not None:
+        previous_memory_limit = resource.getrlimit(resource.RLIMIT_AS)
+        soft_limit = _address_space() + memory_limit
+        hard_limit = previous_memory_limit[1]
+        if hard_limit != resource.RLIM_INFINITY:
+            soft_limit = min(soft_limit, hard_limit)
+        resource.setrlimit(resource.RLIMIT_AS, (soft_limit, hard_limit))
+    timed = bool(time_limit) and hasattr(signal, "setitimer")
+    if timed:
+        signal.signal(signal.SIGALRM, _raise_time_limit_exceeded)
+        # The timer repeats because an exception raised by the handler is swallowed if the signal
+        # happens to be handled inside e.g. a weakref callback
+        signal.setitimer(signal.ITIMER_REAL, time_limit, 0.1)
+    try:
+        with stage("migrate"):
+            migration = Migrate(io.BytesIO(data), target_version, migrators=_worker_migrators)
+            with zipfile.ZipFile(io.BytesIO(data), "r") as source:
+                members = migration.migrated_members(source)
+    finally:
+        if timed:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+        if previous_memory_limit is not None:
+            resource.setrlimit(resource.RLIMIT_AS, previous_memory_limit)
+        samples = profiler.stop() if profiler is not None else None
+    return members, time.perf_counter() - start, samples
+
+
+class BatchMigrate:
+    """Migrate many FCStd files to the same target version. Call run() to process all items; it
+    returns a BatchReport with a result per item and the utilization of each stage.
+
+    readers and writers are the number of I/O threads at each end of the pipeline, jobs the number
+    of migration processes (defaults to the CPU count). queue_depth bounds the number of files that
+    may wait between two stages.
+
+    If memory_budget (in bytes) is given, files are processed largest-first and only as many are
+    read as fit in the budget according to estimate_memory(). file_memory_limit (in bytes) and
+    file_time_limit (in seconds) are enforced on each file in the worker processes, and the worker
+    processes are replaced after each has migrated (on average) max_files_per_worker files.
+
+    Members copied unchanged from the source archives keep their compression, and their compressed
+    bytes are copied as they are. Identical members are found through a cache holding up to
+    dedup_cache_size compressed bytes (zero disables the cache) and written from it.
+
+    Unless skip_up_to_date is cleared, files whose provenance shows that they are already migrated
+    to the target version with every applicable migrator are copied to their destination unchanged.
+
+    The sources are read from source_storage and the destinations written to destination_storage
+    (both default to the local filesystem).
+
+    With profile set, every process samples its stacks by pipeline stage and migrator, and the
+    merged samples are returned in the report."""
+
+    def __init__(
+        self,
+        items: List[BatchItem],
+        target_version: Version,
+        jobs: Optional[int] = None,
+        readers: int = 2,
+        writers: int = 2,
+        queue_depth: int = 4,
+        memory_budget: Optional[int] = None,
+        file_memory_limit: Optional[int] = None,
+        file_time_limit: Optional[float] = None,
+        max_files_per_worker: Optional[int] = None,
+        profile: bool = False,
+        dedup_cache_size: int = DEDUP_CACHE_SIZE,
+        skip_up_to_date: bool = True,
+        source_storage: Storage = LOCAL,
+        destination_storage: Storage = LOCAL,
+    ):
+        self.items = items
+        self.target_version = target_version
+        self.jobs = jobs or os.cpu_count() or 1
+        self.readers = readers
+        self.writers = writers
+        self.queue_depth = queue_depth
+        self.memory_budget = memory_budget
+        self.file_memory_limit = file_memory_limit
+        self.file_time_limit = file_time_limit
+        self.max_files_per_worker = max_files_per_worker
+        self.profile = profile
+        self.dedup_cache_size = dedup_cache_size
+        self.skip_up_to_date = skip_up_to_date
+        self.source_storage = source_storage
+        self.destination_storage = destination_storage
+
+    def run(self) -> BatchReport:
+        start = time.perf_counter()
+        self._estimates = {}
+        schedule = self.items
+        if self.memory_budget is not None:
+            # Each estimate is a small read (a request, in remote storage), so they are made by as
+            # many threads as there are readers
+            with ThreadPoolExecutor(max_workers=self.readers) as executor:
+                estimates = list(executor.map(self._estimate, self.items))
+            self._estimates = {item.source: e for item, e in zip(self.items, estimates)}
+            schedule = sorted(self.items, key=lambda item: -self._estimates[item.source])
+        self._budget = MemoryBudget(self.memory_budget)
+        self._migrators = discover_migrators() if self.skip_up_to_date else None
+        self._pending = queue.Queue()
+        for item in schedule:
+            self._pending.put(item)
+        self._read_queue = queue.Queue(maxsize=self.queue_depth)
+        # Files that have been handed to the migration stage but are not finished yet. Acquired
+        # before a file is submitted for migration and released once it has been written.
+        in_flight = self.jobs + self.queue_depth + self.writers
+        self._in_flight = threading.BoundedSemaphore(in_flight)
+        self._write_queue = queue.Queue(maxsize=in_flight + self.writers)
+        self._results = []
+        self._results_lock = threading.Lock()
+        self._executor = None
+        self._executor_submissions = 0
+        self._executor_lock = threading.Lock()
+        self._profiles = []
+        self._cache = MemberCache(self.dedup_cache_size) if self.dedup_cache_size > 0 else None
+        profiler = SamplingProfiler() if self.profile else None
+        if profiler is not None:
+            profiler.start()
+        self.stages = {
+            "read": StageStats(self.readers),
+            "migrate": StageStats(self.jobs),
+            "write": StageStats(self.writers),
+        }
+        self.queues = {
+            "read": QueueStats(self._read_queue.maxsize),
+            "write": QueueStats(in_flight),
+        }
+
+        if self.items:
+            threads = [threading.Thread(target=self._read) for _ in range(self.readers)]
+            threads += [threading.Thread(target=self._write) for _ in range(self.writers)]
+            threads.append(threading.Thread(target=self._dispatch))
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            if self._executor is not None:
+                self._executor.shutdown()
+
+        order = {item.source: index for index, item in enumerate(self.items)}
+        results = sorted(self._results, key=lambda result: order[result.source])
+        profile = None
+        if profiler is not None:
+            profile = merge([profiler.stop()] + self._profiles)
+        dedup = self._cache.stats if self._cache is not None else None
+        return BatchReport(
+            results, time.perf_counter() - start, self.stages, self.queues, profile, dedup
+        )
+
+    def _estimate(self, item: BatchItem) -> int:
+        try:
+            return estimate_memory(item.source, self.source_storage)
+        except OSError:
+            return 0
+
+    def _read(self):
+        while True:
+            try:
+                item = self._pending.get_nowait()
+            except queue.Empty:
+                return
+            self._budget.acquire(self._estimates.get(item.source, 0))
+            start = time.perf_counter()
+            try:
+                with stage("read"):
+                    up_to_date = self._is_up_to_date(item.source)
+                    data = None
+                    # An up-to-date file that is its own destination is not even read
+                    if not (up_to_date and self._in_place(item)):
+                        with self.source_storage.open_read(item.source) as f:
+                            data = f.read()
+            except Exception as e:
+                self._read_queue.put((item, None, f"{type(e).__name__}: {e}", False))
+                continue
+            self.stages["read"].add(time.perf_counter() - start)
+            self._read_queue.put((item, data, None, up_to_date))
+
+    def _is_up_to_date(self, source_file: str) -> bool:
+        """Check the provenance of a source file, reading only its zip directory and provenance
+        member (which, from remote storage, are fetched with range requests)."""
+        if self._migrators is None:
+            return False
+        try:
+            with self.source_storage.open_read(source_file) as f, zipfile.ZipFile(f, "r") as source:
+                return is_up_to_date(source, self.target_version, self._migrators)
+        except zipfile.BadZipFile:
+            return False
+
+    def _in_place(self, item: BatchItem) -> bool:
+        return self.source_storage is self.destination_storage and (
+            os.path.abspath(item.source) == os.path.abspath(item.destination)
+        )
+
+    def _dispatch(self):
+        for _ in range(len(self.items)):
+            self.queues["read"].sample(self._read_queue.qsize())
+            item, data, error, up_to_date = self._read_queue.get()
+            self._in_flight.acquire()
+            if error is not None:
+                self._write_queue.put_nowait((item, None, error, 1))
+                continue
+            if up_to_date:
+                self._write_queue.put_nowait((item, data, None, 1))
+                continue
+            self._submit(item, data, 1)
+
+    def _submit(self, item: BatchItem, data: bytes, attempt: int):
+        """Submit a file for migration; the writers pick it up when it is done. The worker pool is
+        replaced when it has been given its share of files, or when one of its processes died."""
+        with self._executor_lock:
+            if self.max_files_per_worker is not None and (
+                self._executor_submissions >= self.max_files_per_worker * self.jobs
+            ):
+                self._replace_executor()
+            future = None
+            while future is None:
+                if self._executor is None:
+                    self._replace_executor()
+                try:
+                    future = self._executor.submit(
+                        _migrate_in_worker,
+                        data,
+                        self.target_version,
+                        self.file_memory_limit,
+                        self.file_time_limit,
+                        self.profile,
+                    )
+                except BrokenProcessPool:
+                    self._replace_executor()
+                except Exception as e:
+                    error = f"{type(e).__name__}: {e}"
+                    self._write_queue.put_nowait((item, None, error, attempt))
+                    return
+            self._executor_submissions += 1
+        future.add_done_callback(lambda f: self._write_queue.put_nowait((item, data, f, attempt)))
+
+    def _migrate_alone(self, data: bytes) -> Future:
+        """Migrate a file in a worker process of its own, and return the finished future."""
+        with ProcessPoolExecutor(max_workers=1, initializer=_init_worker) as executor:
+            return executor.submit(
+                _migrate_in_worker,
+                data,
+                self.target_version,
+                self.file_memory_limit,
+                self.file_time_limit,
+                self.profile,
+            )
+
+    def _replace_executor(self):
+        if self._executor is not None:
+            # Files already submitted to the old pool are finished before it shuts down
+            self._executor.shutdown(wait=False)
+        self._executor = ProcessPoolExecutor(max_workers=self.jobs, initializer=_init_worker)
+        self._executor_submissions = 0
+
+    def _finish(self, result: FileResult):
+        """Record the result of a file and free its resources. After the last file, tell the
+        writers to stop."""
+        self._budget.release(self._estimates.get(result.source, 0))
+        self._in_flight.release()
+        with self._results_lock:
+            self._results.append(result)
+            if len(self._results) == len(self.items):
+                for _ in range(self.writers):
+                    self._write_queue.put_nowait(None)
+
+    def _write(self):
+        while True:
+            self.queues["write"].sample(self._write_queue.qsize())
+            entry = self._write_queue.get()
+            if entry is None:
+                return
+            item, data, outcome, attempt = entry
+            if isinstance(outcome, str):
+                self._finish(FileResult(item.source, item.destination, outcome))
+                continue
+            if outcome is None:
+                error = self._copy_unchanged(item, data)
+                self._finish(FileResult(item.source, item.destination, error, skipped=True))
+                continue
+            try:
+                members, seconds, samples = outcome.result()
+            except BrokenProcessPool:
+                if attempt < MAX_ATTEMPTS:
+                    self._write_queue.put_nowait(
+                        (item, data, self._migrate_alone(data), attempt + 1)
+                    )
+                else:
+                    self._finish(
+                        FileResult(item.source, item.destination, "worker process died", True)
+                    )
+                continue
+            except MemoryError:
+                error = "exceeded the per-file memory limit"
+                self._finish(FileResult(item.source, item.destination, error, True))
+                continue
+            except TimeLimitExceeded:
+                error = "exceeded the per-file time limit"
+                self._finish(FileResult(item.source, item.destination, error, True))
+                continue
+            except Exception as e:
+                self._finish(FileResult(item.source, item.destination, f"{type(e).__name__}: {e}"))
+                continue
+            self.stages["migrate"].add(seconds)
+            if samples is not None:
+                with self._results_lock:
+                    self._profiles.append(samples)
+            error = self._write_migrated(item, data, members)
+            self._finish(FileResult(item.source, item.destination, error))
+
+    def _copy_unchanged(self, item: BatchItem, data: Optional[bytes]) -> Optional[str]:
+        start = time.perf_counter()
+        try:
+            if not self._in_place(item):
+                output = self.destination_storage.open_write(item.destination)
+                with stage("write"), output as f:
+                    f.write(data)
+        except Exception as e:
+            return f"{type(e).__name__}: {e}"
+        self.stages["write"].add(time.perf_counter() - start)
+        return None
+
+    def _write_migrated(
+        self, item: BatchItem, data: bytes, members: Dict[str, bytes]
+    ) -> Optional[str]:
+        start = time.perf_counter()
+        try:
+            output = self.destination_storage.open_write(item.destination)
+            with output, zipfile.ZipFile(io.BytesIO(data), "r") as source, stage("write"):
+                write_archives(source, [(output, members)], self._cache)
+        except Exception as e:
+            return f"{type(e).__name__}: {e}"
+        self.stages["write"].add(time.perf_counter() - start)
+        return None
@@ -0,0 +1,198 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+
+# Copying of the members that are copied unchanged into migrated files (BREP shapes, thumbnails,
+# etc.), and their deduplication across archives. The members keep the compression they have in the
+# source archive, and their compressed bytes are copied as they are, without being decompressed and
+# compressed again. Many files in a library carry byte-identical members, e.g. copies of the same
+# standard part, so the compressed bytes of each member are kept in a cache shared by all the
+# archives written during a batch. The CRC and size from the zip directory are used as a cheap
+# pre-key: a member's contents are only hashed when the cache already holds a member with the same
+# CRC and size but different compressed bytes, and a confirmed duplicate is written from the cache.
+
+import hashlib
+import struct
+import sys
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+import zipfile
+
+
+class DedupStats:
+    """Number and uncompressed size of the members copied, and of those that were duplicates."""
+
+    def __init__(self):
+        self.members = 0
+        self.bytes = 0
+        self.duplicates = 0
+        self.duplicate_bytes = 0
+        self._lock = threading.Lock()
+
+    def add(self, size: int, duplicate: bool):
+        with self._lock:
+            self.members += 1
+            self.bytes += size
+            if duplicate:
+                self.duplicates += 1
+                self.duplicate_bytes += size
+
+    @property
+    def ratio(self) -> float:
+        """Ratio of the bytes copied to the bytes of the distinct members among them."""
+        unique_bytes = self.bytes - self.duplicate_bytes
+        return self.bytes / unique_bytes if unique_bytes else 1.0
+
+
+class _Entry:
+    """The compressed bytes of one member, and the digest of its uncompressed contents (computed
+    only once another member with the same CRC and size but different compressed bytes turns
+    up)."""
+
+    def __init__(self, compress_type: int, compressed: bytes, digest: Optional[bytes] = None):
+        self.compress_type = compress_type
+        self.compressed = compressed
+        self._digest = digest
+
+    def digest(self) -> bytes:
+        if self._digest is None:
+            data = self.compressed
+            if self.compress_type == zipfile.ZIP_DEFLATED:
+                data = zlib.decompress(data, -15)
+            self._digest = hashlib.sha256(data).digest()
+        return self._digest
+
+
+# zipfile has no public API for reading or appending a member's compressed bytes, so
+# read_compressed() and _write_raw() are the only places that rely on ZipFile internals (fp,
+# start_dir, filelist, NameToInfo, _lock, _writing, _seekable, _writecheck() and the local file
+# header layout). They are the same in every Python version from 3.8 to 3.13; on any other version
+# the members are decompressed by read() and compressed again by writestr().
+RAW_WRITES = (3, 8) <= sys.version_info[:2] <= (3, 13)
+
+
+def read_compressed(source: zipfile.ZipFile, info: zipfile.ZipInfo) -> Optional[bytes]:
+    """The compressed bytes of a member of an archive opened for reading, or None if they cannot be
+    copied as they are (on other Python versions, or if the member is encrypted)."""
+    if not RAW_WRITES or info.flag_bits & 0x1:
+        return None
+    with source._lock:
+        source.fp.seek(info.header_offset)
+        header = source.fp.read(zipfile.sizeFileHeader)
+        if len(header) != zipfile.sizeFileHeader or header[:4] != zipfile.stringFileHeader:
+            raise zipfile.BadZipFile(f"Bad local file header for {info.filename}")
+        fields = struct.unpack(zipfile.structFileHeader, header)
+        skip = fields[zipfile._FH_FILENAME_LENGTH] + fields[zipfile._FH_EXTRA_FIELD_LENGTH]
+        source.fp.seek(skip, 1)
+        compressed = source.fp.read(info.compress_size)
+    if len(compressed) != info.compress_size:
+        raise zipfile.BadZipFile(f"Truncated member {info.filename}")
+    return compressed
+
+
+def _write_raw(archive: zipfile.ZipFile, info: zipfile.ZipInfo, compressed: bytes):
+    """Do what writestr() does, minus the compression. The local header is written with the final
+    CRC and sizes, so no data descriptor is needed and the output need not be seekable."""
+    with archive._lock:
+        if archive._writing:
+            raise ValueError("Can't write to ZIP archive while an open writing handle exists")
+        archive._writecheck(info)
+        if archive._seekable:
+            archive.fp.seek(archive.start_dir)
+        info.header_offset = archive.fp.tell()
+        archive.fp.write(info.FileHeader())
+        archive.fp.write(compressed)
+        archive.filelist.append(info)
+        archive.NameToInfo[info.filename] = info
+        archive.start_dir = archive.fp.tell()
+
+
+def write_compressed(
+    archive: zipfile.ZipFile,
+    source_info: zipfile.ZipInfo,
+    compressed: Optional[bytes],
+    data: Optional[bytes] = None,
+):
+    """Append a member to an archive opened for writing, with the name, timestamp, attributes and
+    compression of source_info, writing its already compressed bytes when they are given, and
+    otherwise compressing data (the uncompressed contents)."""
+    info = zipfile.ZipInfo(source_info.filename, source_info.date_time)
+    info.external_attr = source_info.external_attr
+    info.compress_type = source_info.compress_type
+    if compressed is None:
+        archive.writestr(info, data)
+        return
+    info.CRC = source_info.CRC
+    info.file_size = source_info.file_size
+    info.compress_size = len(compressed)
+    _write_raw(archive, info, compressed)
+
+
+def copy_member(source: zipfile.ZipFile, info: zipfile.ZipInfo, archives: List[zipfile.ZipFile]):
+    """Copy a member of source into each of the archives, compressed as it is in the source."""
+    compressed = read_compressed(source, info)
+    data = source.read(info) if compressed is None else None
+    for archive in archives:
+        write_compressed(archive, info, compressed, data)
+
+
+# Compression methods of the members that are cached, i.e. that _Entry.digest() can decompress
+CACHED_COMPRESS_TYPES = (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED)
+
+
+class MemberCache:
+    """Thread-safe cache of compressed archive members, holding at most max_size compressed bytes
+    (the least recently used members are evicted first)."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.size = 0
+        self.stats = DedupStats()
+        self._entries: Dict[Tuple[int, int], List[_Entry]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def copy(self, source: zipfile.ZipFile, info: zipfile.ZipInfo, archives: List[zipfile.ZipFile]):
+        """Copy a member of source into each of the archives, compressed as it is in the source, and
+        record whether an identical member was copied earlier."""
+        compressed = read_compressed(source, info)
+        duplicate = False
+        if compressed is not None and info.compress_type in CACHED_COMPRESS_TYPES:
+            compressed, duplicate = self._deduplicate(source, info, compressed)
+        self.stats.add(info.file_size, duplicate)
+        data = source.read(info) if compressed is None else None
+        for archive in archives:
+            write_compressed(archive, info, compressed, data)
+
+    def _deduplicate(
+        self, source: zipfile.ZipFile, info: zipfile.ZipInfo, compressed: bytes
+    ) -> Tuple[bytes, bool]:
+        """The cached compressed bytes of a member identical to the given one, if there is one, or
+        else the given bytes, which are added to the cache; and whether it was a duplicate."""
+        key = (info.CRC, info.file_size)
+        with self._lock:
+            candidates = [
+                c for c in self._entries.get(key, ()) if c.compress_type == info.compress_type
+            ]
+        entry = next((c for c in candidates if c.compressed == compressed), None)
+        digest = None
+        if entry is None and candidates:
+            digest = hashlib.sha256(source.read(info)).digest()
+            entry = next((c for c in candidates if c.digest() == digest), None)
+        if entry is None:
+            self._add(key, _Entry(info.compress_type, compressed, digest))
+            return compressed, False
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+        return entry.compressed, True
+
+    def _add(self, key: Tuple[int, int], entry: _Entry):
+        if len(entry.compressed) > self.max_size:
+            return
+        with self._lock:
+            self._entries.setdefault(key, []).append(entry)
+            self._entries.move_to_end(key)
+            self.size += len(entry.compressed)
+            while self.size > self.max_size:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= sum(len(e.compressed) for e in evicted)
@@ -8,10 +8,19 @@ from typing import Type, List
 from .migrator import Migrator
 
 
+def _loaded_from(module, py_file: pathlib.Path) -> bool:
+    filename = getattr(module, "__file__", None)
+    return filename is not None and pathlib.Path(filename).resolve() == py_file.resolve()
+
+
 def find_migrator_subclasses(root: str) -> List[Type[Migrator]]:
-    """Find all Migrator subclasses in the given directory and its subdirectories."""
+    """Find all Migrator subclasses in the given directory and its subdirectories.
+
+    Modules that were already loaded from the same file are reused rather than executed again, so
+    the classes found by every call are the same objects, and stay picklable."""
     base_path = pathlib.Path(root).resolve()
-    sys.path.insert(0, str(base_path.parent))
+    if str(base_path.parent) not in sys.path:
+        sys.path.insert(0, str(base_path.parent))
 
     migrators = []
 
@@ -22,15 +31,20 @@ def find_migrator_subclasses(root: str) -> List[Type[Migrator]]:
         module_name = (
             py_file.with_suffix("").relative_to(base_path.parent).as_posix().replace("/", ".")
         )
-        spec = importlib.util.find_spec(module_name)
-        if spec is None:
-            spec = importlib.util.spec_from_file_location(module_name, str(py_file))
-        if spec and spec.loader:
+        module = sys.modules.get(module_name)
+        if module is None or not _loaded_from(module, py_file):
+            spec = importlib.util.find_spec(module_name)
+            if spec is None:
+                spec = importlib.util.spec_from_file_location(module_name, str(py_file))
+            if not spec or not spec.loader:
+                continue
             module = importlib.util.module_from_spec(spec)
+            # Registered so that the classes can be pickled, e.g. to send them to worker processes
+            sys.modules[module_name] = module
             spec.loader.exec_module(module)
 
-            for _, obj in inspect.getmembers(module, inspect.isclass):
-                if issubclass(obj, Migrator) and obj is not Migrator:
-                    migrators.append(obj)
+        for _, obj in inspect.getmembers(module, inspect.isclass):
+            if issubclass(obj, Migrator) and obj is not Migrator:
+                migrators.append(obj)
 
     return migrators
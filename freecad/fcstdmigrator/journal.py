@@ -0,0 +1,137 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+
+# A change journal for in-place edits of element trees. While a Journal is active, the editing
+# functions below (used by the Migrator helpers) record the old state of whatever they are about to
+# change, so that a migration that fails partway through can be rolled back in place instead of
+# re-reading and re-parsing the file. Recording is copy-on-write: only the first change to each
+# attribute, text, child list or subtree is recorded, however often it is changed afterwards.
+#
+# Journals may be nested (e.g. one per migration step inside one for a whole export), and every
+# active journal of the current thread records each change. Edits made to elements directly,
+# without going through these functions, are not recorded and cannot be rolled back.
+
+import threading
+from typing import Callable, List, Optional
+from xml.etree.ElementTree import Element
+
+_local = threading.local()
+
+# Marks an attribute that did not exist before it was set
+_MISSING = object()
+
+
+def _active() -> List["Journal"]:
+    if not hasattr(_local, "journals"):
+        _local.journals = []
+    return _local.journals
+
+
+class Journal:
+    """Records the old state of edited elements while active (use as a context manager), and
+    restores it on rollback()."""
+
+    def __init__(self):
+        self._undo: List[Callable[[], None]] = []
+        self._recorded = set()
+
+    def __enter__(self):
+        _active().append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _active().remove(self)
+
+    def __len__(self) -> int:
+        return len(self._undo)
+
+    def _first_change(self, element: Element, what) -> bool:
+        # The undo entries keep the elements alive, so their ids are not reused while recorded
+        key = (id(element), what)
+        if key in self._recorded:
+            return False
+        self._recorded.add(key)
+        return True
+
+    def record_attribute(self, element: Element, name: str):
+        if self._first_change(element, ("attribute", name)):
+            old = element.get(name, _MISSING)
+            self._undo.append(lambda: _restore_attribute(element, name, old))
+
+    def record_text(self, element: Element):
+        if self._first_change(element, "text"):
+            old = element.text
+            self._undo.append(lambda: setattr(element, "text", old))
+
+    def record_children(self, element: Element):
+        if self._first_change(element, "children"):
+            old = list(element)
+            self._undo.append(lambda: element.__setitem__(slice(None), old))
+
+    def record_subtree(self, element: Element):
+        """Record the complete state of element and everything below it, for edits that cannot be
+        tracked individually."""
+        if self._first_change(element, "subtree"):
+            state = [
+                (node, dict(node.attrib), node.text, node.tail, list(node))
+                for node in element.iter()
+            ]
+            self._undo.append(lambda: _restore_subtree(state))
+
+    def rollback(self):
+        """Undo every recorded change, newest first, and start recording afresh."""
+        while self._undo:
+            self._undo.pop()()
+        self._recorded.clear()
+
+
+def _restore_attribute(element: Element, name: str, old):
+    if old is _MISSING:
+        element.attrib.pop(name, None)
+    else:
+        element.set(name, old)
+
+
+def _restore_subtree(state):
+    for node, attrib, text, tail, children in state:
+        node.attrib.clear()
+        node.attrib.update(attrib)
+        node.text = text
+        node.tail = tail
+        node[:] = children
+
+
+def set_attribute(element: Element, name: str, value: str):
+    for journal in _active():
+        journal.record_attribute(element, name)
+    element.set(name, value)
+
+
+def set_text(element: Element, text: Optional[str]):
+    for journal in _active():
+        journal.record_text(element)
+    element.text = text
+
+
+def append_child(parent: Element, child: Element):
+    for journal in _active():
+        journal.record_children(parent)
+    parent.append(child)
+
+
+def remove_child(parent: Element, child: Element):
+    for journal in _active():
+        journal.record_children(parent)
+    parent.remove(child)
+
+
+def record_children(element: Element):
+    """Record the children of element in every active journal, before changing them directly."""
+    for journal in _active():
+        journal.record_children(element)
+
+
+def record_subtree(element: Element):
+    """Record element and everything below it in every active journal, before changing them
+    directly."""
+    for journal in _active():
+        journal.record_subtree(element)
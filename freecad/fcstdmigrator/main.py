@@ -1,27 +1,232 @@
 # SPDX-License-Identifier: LGPL-2.1-or-later
 
-# To run the migrator from the command line run this file with python and three arguments: the input
-# FCStd file, the output FCStd file, and the FreeCAD version to migrate to. Note that this is not
-# the main intended use for this software and is provided mainly for testing purposes.
+# To run the migrator from the command line run this file with python, giving at least the input
+# FCStd file or directory (-i), the output file or directory (-o), and the FreeCAD version to
+# migrate to (-v); run it with --help for the other options. Note that this is not the main
+# intended use for this software and is provided mainly for testing purposes.
 
 import argparse
 import pathlib
+import sys
+from contextlib import ExitStack
+from typing import List, Optional, Union
+
+from packaging.version import Version
+
+import freecad.fcstdmigrator.batch as batch
 import freecad.fcstdmigrator.migrate as migrate
+import freecad.fcstdmigrator.probe as probe
+import freecad.fcstdmigrator.profiling as profiling
+import freecad.fcstdmigrator.sharding as sharding
+import freecad.fcstdmigrator.storage as storage
+import freecad.fcstdmigrator.verify as verify
+
+
+def shard(value: str):
+    try:
+        return sharding.parse_shard(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def location(value: str) -> Union[str, pathlib.Path]:
+    """A local path, or an s3://bucket/key URL (kept as a string, which pathlib would mangle)."""
+    return value if storage.is_remote(value) else pathlib.Path(value)
+
+
+def is_directory(value: Union[str, pathlib.Path]) -> bool:
+    """Whether a location is a directory: remote directories (key prefixes) end with a slash."""
+    if storage.is_remote(value):
+        return str(value).endswith("/")
+    return value.is_dir()
 
 
 def parse_args() -> argparse.Namespace:
 
     parser = argparse.ArgumentParser(description="Migrate FreeCAD files between different versions")
-    parser.add_argument("-i", "--input", required=True, type=pathlib.Path, help="Input file")
-    parser.add_argument("-o", "--output", required=True, type=pathlib.Path, help="Output file")
-    parser.add_argument("-v", "--version", required=True, help="Target FreeCAD version")
+    parser.add_argument(
+        "-i",
+        "--input",
+        type=location,
+        help="Input file, or a directory to migrate every FCStd file in it. May be an "
+        "s3://bucket/key URL (or an s3://bucket/prefix/ ending with a slash for a directory).",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=location,
+        help="Output file, or the output directory if the input is a directory. May be an "
+        "s3://bucket/key URL.",
+    )
+    parser.add_argument("-v", "--version", help="Target FreeCAD version")
+    parser.add_argument(
+        "-a",
+        "--also-export",
+        nargs=2,
+        action="append",
+        default=[],
+        metavar=("VERSION", "OUTPUT"),
+        help="Also export the input at another FreeCAD version to another output file, without "
+        "re-parsing the input. May be given several times.",
+    )
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="Migrate to the target version and back in memory and report any differences from "
+        "the original instead of writing an output file. The input may be a directory, in which "
+        "case every FCStd file in it is verified.",
+    )
+    parser.add_argument(
+        "--probe",
+        action="store_true",
+        help="Check how far towards the (older) target version the input can be downgraded, and "
+        "which objects block the downgrade, without migrating anything. The input may be a "
+        "directory, in which case every FCStd file in it is probed.",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        help="Number of worker processes. When migrating a single file, very large documents are "
+        "split across this many processes (defaults to 1). When migrating or verifying a "
+        "directory, files are processed in parallel (defaults to the CPU count).",
+    )
+    parser.add_argument(
+        "--readers",
+        type=int,
+        default=2,
+        help="Number of threads prefetching input files when migrating a directory",
+    )
+    parser.add_argument(
+        "--writers",
+        type=int,
+        default=2,
+        help="Number of threads writing output files when migrating a directory",
+    )
+    parser.add_argument(
+        "--queue-depth",
+        type=int,
+        default=4,
+        help="Maximum number of files waiting between two stages when migrating a directory",
+    )
+    parser.add_argument(
+        "--memory-budget",
+        type=int,
+        metavar="MB",
+        help="When migrating a directory, process files largest-first and keep the estimated "
+        "memory use of the files in flight within this budget",
+    )
+    parser.add_argument(
+        "--file-memory-limit",
+        type=int,
+        metavar="MB",
+        help="When migrating a directory, stop migrating any file that needs more memory than this",
+    )
+    parser.add_argument(
+        "--file-time-limit",
+        type=float,
+        metavar="SECONDS",
+        help="When migrating a directory, stop migrating any file that takes longer than this",
+    )
+    parser.add_argument(
+        "--max-files-per-worker",
+        type=int,
+        help="When migrating a directory, replace the worker processes after each has migrated "
+        "this many files",
+    )
+    parser.add_argument(
+        "--dedup-cache",
+        type=int,
+        default=batch.DEDUP_CACHE_SIZE // (1024 * 1024),
+        metavar="MB",
+        help="When migrating a directory, size of the cache used to find members that are "
+        "identical across files (0 disables it)",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="When migrating a directory, also migrate files that were already migrated to the "
+        "target version by every applicable migration (by default they are copied unchanged)",
+    )
+    parser.add_argument(
+        "--shard",
+        type=shard,
+        metavar="i/N",
+        help="When migrating a directory, only migrate the i-th of N disjoint shares of its files "
+        "(counting from 1). Every machine given the same directory computes the same shares.",
+    )
+    parser.add_argument(
+        "--shard-by",
+        choices=("path", "size"),
+        default="path",
+        help="Assign files to shards by a hash of their path (the default, stable as files are "
+        "added), or by balancing the shards' total uncompressed size",
+    )
+    parser.add_argument(
+        "--manifest",
+        type=pathlib.Path,
+        metavar="FILE",
+        help="When migrating a directory, write the result for each file to this JSON manifest",
+    )
+    parser.add_argument(
+        "--merge-manifests",
+        nargs="+",
+        type=pathlib.Path,
+        metavar="FILE",
+        help="Merge the manifests written by the shards of a sharded run into one report, instead "
+        "of migrating anything",
+    )
+    parser.add_argument(
+        "--profile",
+        type=pathlib.Path,
+        metavar="FILE",
+        help="Sample where time is spent (in every worker process, when migrating a directory), "
+        "write the samples to FILE in collapsed-stack format for flame graph tools, and print the "
+        "top stages",
+    )
 
     arguments = parser.parse_args()
 
-    if not arguments.input.is_file():
+    if arguments.merge_manifests:
+        return arguments
+    missing = [name for name in ("input", "version") if getattr(arguments, name) is None]
+    if missing:
+        parser.error(
+            "the following arguments are required: "
+            + ", ".join(f"-{name[0]}/--{name}" for name in missing)
+        )
+
+    if arguments.verify and arguments.probe:
+        parser.error("--verify and --probe cannot be used together")
+    if arguments.verify or arguments.probe:
+        if storage.is_remote(arguments.input):
+            parser.error("--verify and --probe can only be used with local input files")
+        if not arguments.input.is_file() and not arguments.input.is_dir():
+            raise FileNotFoundError(f"Input {arguments.input} does not exist")
+        return arguments
+
+    if arguments.output is None:
+        parser.error("the following arguments are required: -o/--output")
+
+    input_is_directory = is_directory(arguments.input)
+    if not input_is_directory and (arguments.shard or arguments.manifest):
+        parser.error("--shard and --manifest can only be used when the input is a directory")
+    if input_is_directory:
+        if arguments.also_export:
+            parser.error("-a/--also-export cannot be used when the input is a directory")
+        if not storage.is_remote(arguments.output) and arguments.output.is_file():
+            parser.error("the output must be a directory when the input is a directory")
+    elif not storage.is_remote(arguments.input) and not arguments.input.is_file():
         raise FileNotFoundError(f"Input file {arguments.input} does not exist")
+    versions = [Version(arguments.version)] + [Version(v) for v, _ in arguments.also_export]
+    if len(set(versions)) < len(versions):
+        parser.error("each version can only be exported once")
 
-    if arguments.output.exists():
+    # The shards of a sharded run share the output directory and run unattended, so do not ask.
+    # Remote outputs are not checked, as that would need a request per file.
+    outputs = [arguments.output] + [location(output) for _, output in arguments.also_export]
+    local_outputs = [output for output in outputs if not storage.is_remote(output)]
+    if arguments.shard is None and any(output.exists() for output in local_outputs):
         print(
             "WARNING: Output file already exists, it will be overwritten. Continue? (y/N)", end=" "
         )
@@ -31,7 +236,184 @@ def parse_args() -> argparse.Namespace:
     return arguments
 
 
-if __name__ == "__main__":
+def input_files(args: argparse.Namespace) -> List[str]:
+    """The input file, or every FCStd file below the input directory."""
+    if args.input.is_dir():
+        directory = str(args.input)
+        return [
+            storage.LOCAL.join(directory, path)
+            for path in storage.LOCAL.list_files(directory, ".fcstd")
+        ]
+    return [str(args.input)]
+
+
+def run_verify(args: argparse.Namespace) -> int:
+    results = verify.verify_corpus(input_files(args), Version(args.version), args.jobs)
+
+    failures = 0
+    for result in results:
+        if result.ok:
+            continue
+        failures += 1
+        if result.error is not None:
+            print(f"{result.freecad_file}: ERROR {result.error}")
+        for mismatch in result.mismatches:
+            print(f"{result.freecad_file}: {mismatch.document}:{mismatch.path}: {mismatch.reason}")
+    print(f"Verified {len(results)} file(s), {failures} failed to round-trip cleanly")
+    return 1 if failures else 0
+
+
+def run_probe(args: argparse.Namespace) -> int:
+    results = probe.probe_corpus(input_files(args), Version(args.version), args.jobs)
+
+    blocked = 0
+    for result in results:
+        if result.error is not None:
+            blocked += 1
+            print(f"{result.freecad_file}: ERROR {result.error}")
+            continue
+        if not result.ok:
+            blocked += 1
+        print(
+            f"{result.freecad_file}: {result.original_version} can be migrated to "
+            f"{result.reachable_version}"
+        )
+        for blocker in result.blockers:
+            print(f"{result.freecad_file}:   blocked by {blocker.migrator}: {blocker.reason}")
+    print(f"Probed {len(results)} file(s), {blocked} cannot reach {args.version}")
+    return 1 if blocked else 0
+
+
+def megabytes(value: Optional[int]) -> Optional[int]:
+    return None if value is None else value * 1024 * 1024
+
+
+def select_shard(args: argparse.Namespace) -> List[str]:
+    """The paths, relative to the input directory, of the files to migrate in this run."""
+    source_storage, directory = storage.open_location(args.input)
+    relative_paths = source_storage.list_files(directory, ".fcstd")
+    if args.shard is None:
+        return relative_paths
+    index, count = args.shard
+    if args.shard_by == "size":
+        sizes = {
+            path: sharding.uncompressed_size(source_storage.join(directory, path), source_storage)
+            for path in relative_paths
+        }
+        return sharding.shard_by_size(sizes, index, count)
+    return sharding.shard_by_path(relative_paths, index, count)
+
+
+def run_batch(args: argparse.Namespace) -> int:
+    relative_paths = select_shard(args)
+    source_storage, source_directory = storage.open_location(args.input)
+    destination_storage, destination_directory = storage.open_location(args.output)
+    items = [
+        batch.BatchItem(
+            source_storage.join(source_directory, path),
+            destination_storage.join(destination_directory, path),
+        )
+        for path in relative_paths
+    ]
+    engine = batch.BatchMigrate(
+        items,
+        Version(args.version),
+        jobs=args.jobs,
+        readers=args.readers,
+        writers=args.writers,
+        queue_depth=args.queue_depth,
+        memory_budget=megabytes(args.memory_budget),
+        file_memory_limit=megabytes(args.file_memory_limit),
+        file_time_limit=args.file_time_limit,
+        max_files_per_worker=args.max_files_per_worker,
+        profile=args.profile is not None,
+        dedup_cache_size=megabytes(args.dedup_cache),
+        skip_up_to_date=not args.force,
+        source_storage=source_storage,
+        destination_storage=destination_storage,
+    )
+    report = engine.run()
+    for result in report.results:
+        if not result.ok:
+            print(f"{result.source}: {'KILLED' if result.killed else 'ERROR'} {result.error}")
+    print(report.summary())
+    if args.manifest is not None:
+        index, count = args.shard or (1, 1)
+        entries = [
+            sharding.ManifestEntry(path, result.error, result.killed)
+            for path, result in zip(relative_paths, report.results)
+        ]
+        manifest = sharding.Manifest(index, count, args.version, report.elapsed, entries)
+        sharding.write_manifest(str(args.manifest), manifest)
+    if report.profile is not None:
+        report_profile(report.profile, args.profile)
+    return 0 if all(result.ok for result in report.results) else 1
+
+
+def run_merge(args: argparse.Namespace) -> int:
+    manifests = [sharding.read_manifest(str(filename)) for filename in args.merge_manifests]
+    report = sharding.merge_manifests(manifests)
+    for entry in report.entries:
+        if entry.error is not None:
+            print(f"{entry.path}: {'KILLED' if entry.killed else 'ERROR'} {entry.error}")
+    print(report.summary())
+    failed = any(entry.error is not None for entry in report.entries)
+    return 1 if failed or report.missing_shards else 0
+
+
+def report_profile(samples, filename: pathlib.Path):
+    profiling.write_collapsed(samples, str(filename))
+    print(profiling.stage_table(samples))
+    print(f"Wrote {sum(samples.values())} samples to {filename}")
+
+
+def open_file(stack: ExitStack, value: Union[str, pathlib.Path], write: bool = False):
+    """A local file as its path, or a remote one opened (for the duration of the stack) as a file
+    object."""
+    file_storage, path = storage.open_location(value)
+    if file_storage is storage.LOCAL:
+        return path
+    if write:
+        return stack.enter_context(file_storage.open_write(path))
+    return stack.enter_context(file_storage.open_read(path))
+
+
+def migrate_file(args: argparse.Namespace):
+    with ExitStack() as stack:
+        source = open_file(stack, args.input)
+        if args.also_export:
+            outputs = {Version(args.version): open_file(stack, args.output, write=True)}
+            outputs.update(
+                {
+                    Version(version): open_file(stack, output, write=True)
+                    for version, output in args.also_export
+                }
+            )
+            migrator = migrate.Migrate(source, None, args.jobs or 1)
+            migrator.export_versions(outputs)
+            return
+        migrator = migrate.Migrate(source, Version(args.version), args.jobs or 1)
+        migrator.export(open_file(stack, args.output, write=True))
+
+
+def main() -> int:
     args = parse_args()
-    migrator = migrate.Migrate(str(args.input), args.version)
-    migrator.export(str(args.output))
+    if args.merge_manifests:
+        return run_merge(args)
+    if args.verify:
+        return run_verify(args)
+    if args.probe:
+        return run_probe(args)
+    if is_directory(args.input):
+        return run_batch(args)
+    if args.profile is None:
+        migrate_file(args)
+        return 0
+    with profiling.SamplingProfiler() as profiler:
+        migrate_file(args)
+    report_profile(profiler.samples, args.profile)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,29 +1,191 @@
 # SPDX-License-Identifier: LGPL-2.1-or-later
 
 from packaging.version import Version, InvalidVersion
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack, contextmanager, nullcontext
+from itertools import groupby
+from typing import BinaryIO, Dict, List, Optional, Sequence, Tuple, Type, Union
 import zipfile
-from defusedxml.ElementTree import parse
-from xml.etree.ElementTree import Element, tostring
+from defusedxml.ElementTree import parse, fromstring
+from xml.etree.ElementTree import Element, SubElement, tostring
 import re
 
+from .dedup import MemberCache, copy_member
+from . import journal
 from .discover import find_migrator_subclasses
+from .journal import Journal
+from .migrator import IncompatibleVersionException, MemberTransform, Migrator
+from .profiling import stage
+from .provenance import (
+    PROVENANCE_MEMBER,
+    AppliedMigrator,
+    Provenance,
+    missing_migrators,
+    read_provenance,
+)
+
+# The elements holding one child per document object, in Document.xml and GuiDocument.xml
+OBJECT_CONTAINERS = ("ObjectData", "ViewProviderData")
+
+# Documents are only split across processes when every chunk gets at least this many objects,
+# below that the cost of serializing the chunks outweighs the parallelism.
+MIN_OBJECTS_PER_CHUNK = 1000
+
+
+def _split(items: Sequence, count: int) -> List[Sequence]:
+    """Split items into count contiguous, nearly equal slices."""
+    size, remainder = divmod(len(items), count)
+    slices = []
+    start = 0
+    for index in range(count):
+        end = start + size + (1 if index < remainder else 0)
+        slices.append(items[start:end])
+        start = end
+    return slices
+
+
+def _object_chunk(root: Element, container: Element, objects: Sequence[Element]) -> bytes:
+    """Serialize a copy of root's skeleton containing only the given objects in its container."""
+    chunk = Element(root.tag, root.attrib)
+    SubElement(chunk, container.tag, container.attrib).extend(objects)
+    return tostring(chunk, encoding="utf-8")
+
+
+def _migrate_chunk(
+    migrators: List[Type[Migrator]], direction: str, document_chunk: bytes, gui_chunk: bytes
+) -> Tuple[bytes, bytes]:
+    """Worker-process half of Migrate.run_object_local_migrators()."""
+    document_xml = fromstring(document_chunk)
+    gui_document_xml = fromstring(gui_chunk)
+    for migrator in migrators:
+        getattr(migrator(), direction)(document_xml, gui_document_xml)
+    return tostring(document_xml, encoding="utf-8"), tostring(gui_document_xml, encoding="utf-8")
+
+
+def discover_migrators() -> List[Type[Migrator]]:
+    """All available migrators, sorted by the date of the change they migrate."""
+    return sorted(find_migrator_subclasses("migrations"), key=lambda cls: cls.changed_on_date)
+
+
+def backward_plan(
+    migrators: List[Type[Migrator]], from_version: Version, to_version: Version
+) -> List[Type[Migrator]]:
+    """The migrators (sorted as by discover_migrators()) whose backward() takes a file from
+    from_version down to to_version, in the order they must be run."""
+    return [
+        migrator
+        for migrator in reversed(migrators)
+        if to_version < migrator.changed_in_freecad_version <= from_version
+    ]
+
+
+def read_xml(archive: zipfile.ZipFile, xml_file_name: str) -> Element:
+    """Parse an XML document (typically Document.xml or GuiDocument.xml) from within an open FCStd
+    archive."""
+    if xml_file_name not in archive.namelist():
+        raise FileNotFoundError(f"{xml_file_name} not found in {archive.filename or 'the archive'}")
+    with archive.open(xml_file_name) as xml_file, stage("parse"):
+        return parse(xml_file).getroot()
+
+
+def transform_members(
+    source: zipfile.ZipFile, transforms: Sequence[Tuple[str, MemberTransform]]
+) -> Dict[str, bytearray]:
+    """Read each member that has transforms into a buffer and apply its transforms to the buffer in
+    place, in order. Members that do not exist in the source are skipped."""
+    names = set(source.namelist())
+    members = {}
+    for name, transform in transforms:
+        if name not in names:
+            continue
+        if name not in members:
+            members[name] = bytearray(source.read(name))
+        transform(memoryview(members[name]))
+    return members
+
+
+def write_archives(
+    source: zipfile.ZipFile,
+    outputs: List[Tuple[Union[str, BinaryIO], Dict[str, bytes]]],
+    cache: Optional[MemberCache] = None,
+):
+    """Write one FCStd archive per (filename, members) pair, where the filename may also be a
+    writable binary file object (which need not be seekable): the given members first, followed by
+    every other member of the source archive, compressed as it is there. Each source member is read
+    only once, however many outputs it is written to, and its compressed bytes are copied without
+    being decompressed. If a member cache is given, it records which members are duplicates of
+    ones copied earlier."""
+    with ExitStack() as stack:
+        archives = []
+        for filename, members in outputs:
+            archive = stack.enter_context(zipfile.ZipFile(filename, "w"))
+            for name, data in members.items():
+                archive.writestr(name, data)
+            archives.append((archive, members))
+        for info in source.infolist():
+            item = info.filename
+            targets = [archive for archive, members in archives if item not in members]
+            if not targets:
+                continue
+            if cache is not None:
+                cache.copy(source, info, targets)
+            else:
+                copy_member(source, info, targets)
 
 
 class Migrate:
     """Primary migration class: instantiate with a FreeCAD file and a target version to perform
-    an in-memory migration. Use the export() method to write the resulting FCStd file to disk."""
+    an in-memory migration. Use the export() method to write the resulting FCStd file to disk. If
+    target_version is None the file is only loaded, e.g. to then export_versions() several targets.
+    The FreeCAD file may be given as a path or as a seekable binary file object.
 
-    def __init__(self, freecad_file: str, target_version: Version):
+    With jobs greater than one, migrators that declare themselves object_local are run on chunks of
+    very large documents in that many worker processes. The result is identical to a serial run.
+
+    Exported files record their provenance (see provenance.py). If the file was itself exported
+    by this tool and apply_delta is set, the migrators that have been added since it was exported
+    are applied first.
+
+    The available migrators are discovered unless given, sorted as by discover_migrators(), e.g. by
+    a process that migrates many files."""
+
+    def __init__(
+        self,
+        freecad_file: Union[str, BinaryIO],
+        target_version: Optional[Version],
+        jobs: int = 1,
+        apply_delta: bool = True,
+        migrators: Optional[List[Type[Migrator]]] = None,
+    ):
         self.freecad_file = freecad_file
         self.target_version = target_version
+        self.jobs = jobs
         self.original_version = target_version  # Overwritten with contents of Document.xml below
         self.document_xml = self.load_xml("Document.xml")
         self.gui_document_xml = self.load_xml("GuiDocument.xml")
 
-        discovered_migrators = find_migrator_subclasses("migrations")
-        self.migrators = sorted(discovered_migrators, key=lambda cls: cls.date)
+        # Transforms of binary archive members requested by the migrators run so far, in order
+        self.member_transforms: List[Tuple[str, MemberTransform]] = []
+
+        self.current_version = self.original_version
+        self.migrators = discover_migrators() if migrators is None else migrators
+
+        # The version the file was first migrated from, and the net migrators applied since
+        with zipfile.ZipFile(self.freecad_file, "r") as z:
+            provenance = read_provenance(z)
+        if provenance is not None and provenance.target_version != self.original_version:
+            provenance = None
+        self.source_version = self.original_version
+        self.applied: List[AppliedMigrator] = []
+        if provenance is not None:
+            self.source_version = provenance.source_version
+            self.applied = list(provenance.applied)
+            if apply_delta:
+                self.apply_delta(provenance)
 
-        if self.target_version < self.original_version:
+        if self.target_version is None:
+            self.target_version = self.original_version
+        elif self.target_version < self.original_version:
             self.run_backward_migration()
         elif self.target_version > self.original_version:
             self.run_forward_migration()
@@ -34,15 +196,10 @@ class Migrate:
         """Load an XML document from within the FCStd file (typically Document.xml or
         GuiDocument.xml)."""
         with zipfile.ZipFile(self.freecad_file, "r") as z:
-            if xml_file_name not in z.namelist():
-                raise FileNotFoundError(f"{xml_file_name} not found in {self.freecad_file}")
-
-            with z.open(xml_file_name) as xml_file:
-                tree = parse(xml_file)
-                root = tree.getroot()
-                if xml_file_name == "Document.xml":
-                    self.original_version = self.extract_version_from_xml(root)
-                return root
+            root = read_xml(z, xml_file_name)
+        if xml_file_name == "Document.xml":
+            self.original_version = self.extract_version_from_xml(root)
+        return root
 
     @staticmethod
     def extract_version_from_xml(root: Element) -> Version:
@@ -72,29 +229,221 @@ class Migrate:
         except InvalidVersion:
             raise ValueError(f"Unrecognized ProgramVersion format: {raw}")
 
+    def forward_plan(self, from_version: Version, to_version: Version) -> List[Type[Migrator]]:
+        """The migrators whose forward() takes a file from from_version to to_version, in the order
+        they must be run."""
+        return [
+            migrator
+            for migrator in self.migrators
+            if from_version < migrator.changed_in_freecad_version <= to_version
+        ]
+
+    def backward_plan(self, from_version: Version, to_version: Version) -> List[Type[Migrator]]:
+        """The migrators whose backward() takes a file from from_version down to to_version, in the
+        order they must be run."""
+        return backward_plan(self.migrators, from_version, to_version)
+
+    @contextmanager
+    def transaction(self):
+        """Roll back all changes made to the in-memory documents inside this context if it raises,
+        leaving them (and the current version) as they were when it was entered."""
+        versions = self.current_version, self.target_version
+        transform_count = len(self.member_transforms)
+        applied = list(self.applied)
+        with Journal() as changes:
+            try:
+                yield changes
+            except BaseException:
+                changes.rollback()
+                self.current_version, self.target_version = versions
+                del self.member_transforms[transform_count:]
+                self.applied = applied
+                raise
+
+    def migrate_to(self, version: Version):
+        """Migrate the in-memory documents from their current version to the given version. May be
+        called repeatedly, e.g. to migrate forward and then back again. If a migrator fails, the
+        documents are rolled back to the current version before the exception is re-raised."""
+        self.target_version = version
+        if version < self.current_version:
+            self.run_backward_migration()
+        elif version > self.current_version:
+            self.run_forward_migration()
+
+    def migrate_to_first_compatible(self, versions: Sequence[Version]) -> Version:
+        """Migrate to the first of the given versions that the documents can be migrated to
+        (e.g. the newest of several older versions), rolling back in place after each failed
+        attempt. Returns the version migrated to, or re-raises the last IncompatibleVersionException
+        if none of them is possible."""
+        error = None
+        for version in versions:
+            try:
+                self.migrate_to(version)
+                return version
+            except IncompatibleVersionException as e:
+                print(f"Cannot migrate to {version}: {e}")
+                error = e
+        if error is None:
+            raise ValueError("No versions to migrate to")
+        raise error
+
+    def apply_delta(self, provenance: Provenance):
+        """Apply the migrators that belong to the migration recorded in the provenance but were not
+        applied when the file was exported, e.g. because they have been added since."""
+        direction, missing = missing_migrators(provenance, self.migrators)
+        if missing:
+            with self.transaction():
+                self.run_plan(missing, direction)
+
     def run_forward_migration(self):
-        for migrator in self.migrators:
-            if self.original_version < migrator.changed_in_freecad_version:
-                print(f"Running forward migration {migrator.name}...")
-                migrator().forward(self.document_xml, self.gui_document_xml)
+        with self.transaction():
+            self.run_plan(self.forward_plan(self.current_version, self.target_version), "forward")
+            self.current_version = self.target_version
 
     def run_backward_migration(self):
-        for migrator in reversed(self.migrators):
-            if self.original_version > migrator.changed_in_freecad_version:
-                print(f"Running backward migration {migrator.name}...")
-                migrator().backward(self.document_xml, self.gui_document_xml)
-
-    def export(self, filename: str):
-        """Write the modified FCStd file to the given file."""
-
-        # Update the version strings
-        self.document_xml.set("ProgramVersion", str(self.target_version))
-        self.gui_document_xml.set("ProgramVersion", str(self.target_version))
-
-        with zipfile.ZipFile(filename, "a") as outfile:
-            outfile.writestr("Document.xml", tostring(self.document_xml, encoding="utf-8"))
-            outfile.writestr("GuiDocument.xml", tostring(self.gui_document_xml, encoding="utf-8"))
-            with zipfile.ZipFile(self.freecad_file, "r") as z:
-                for item in z.namelist():
-                    if item not in ("Document.xml", "GuiDocument.xml"):
-                        outfile.writestr(item, z.read(item))
+        with self.transaction():
+            self.run_plan(self.backward_plan(self.current_version, self.target_version), "backward")
+            self.current_version = self.target_version
+
+    def run_plan(self, plan: List[Type[Migrator]], direction: str):
+        """Run the "forward" or "backward" method of each migrator in the plan, in order. Runs of
+        consecutive object-local migrators are parallelized when more than one job is allowed."""
+        for parallel, group in groupby(plan, key=lambda m: self.jobs > 1 and m.object_local):
+            group = list(group)
+            if parallel:
+                with stage("migrator:" + ", ".join(migrator.name for migrator in group)):
+                    self.run_object_local_migrators(group, direction)
+                for migrator in group:
+                    self.add_member_transforms(migrator(), direction)
+                    self.record_applied(migrator, direction)
+                continue
+            for migrator in group:
+                print(f"Running {direction} migration {migrator.name}...")
+                with stage(f"migrator:{migrator.name}"):
+                    instance = migrator()
+                    getattr(instance, direction)(self.document_xml, self.gui_document_xml)
+                self.add_member_transforms(instance, direction)
+                self.record_applied(migrator, direction)
+
+    def record_applied(self, migrator: Type[Migrator], direction: str):
+        """Add a migrator to the applied migrators, or cancel it out if it was applied in the other
+        direction (e.g. when migrating forward and then back again)."""
+        for index in reversed(range(len(self.applied))):
+            applied = self.applied[index]
+            if applied.is_migrator(migrator) and applied.direction != direction:
+                del self.applied[index]
+                return
+        self.applied.append(AppliedMigrator.of(migrator, direction))
+
+    def add_member_transforms(self, migrator: Migrator, direction: str):
+        members = getattr(migrator, f"{direction}_members")(
+            self.document_xml, self.gui_document_xml
+        )
+        self.member_transforms.extend(members.items())
+
+    def run_object_local_migrators(self, migrators: List[Type[Migrator]], direction: str):
+        """Run object-local migrators with the children of ObjectData and ViewProviderData split
+        into chunks that are migrated in worker processes. Everything outside those containers is
+        migrated in this process, and the migrated chunks are merged back in their original
+        order."""
+        roots = (self.document_xml, self.gui_document_xml)
+        containers = [root.find(tag) for root, tag in zip(roots, OBJECT_CONTAINERS)]
+        if any(container is None for container in containers):
+            chunk_count = 0
+        else:
+            objects = [list(container) for container in containers]
+            largest = max(len(children) for children in objects)
+            chunk_count = min(self.jobs, largest // MIN_OBJECTS_PER_CHUNK)
+        if chunk_count < 2:
+            for migrator in migrators:
+                print(f"Running {direction} migration {migrator.name}...")
+                getattr(migrator(), direction)(self.document_xml, self.gui_document_xml)
+            return
+
+        for migrator in migrators:
+            print(f"Running {direction} migration {migrator.name} in {chunk_count} processes...")
+        chunks = [
+            [_object_chunk(root, container, part) for part in _split(children, chunk_count)]
+            for root, container, children in zip(roots, containers, objects)
+        ]
+        with ProcessPoolExecutor(max_workers=chunk_count) as executor:
+            futures = [
+                executor.submit(_migrate_chunk, migrators, direction, document_chunk, gui_chunk)
+                for document_chunk, gui_chunk in zip(*chunks)
+            ]
+            for container in containers:
+                journal.record_children(container)
+                del container[:]
+            for migrator in migrators:
+                getattr(migrator(), direction)(self.document_xml, self.gui_document_xml)
+            results = [future.result() for future in futures]
+
+        for index, (container, tag) in enumerate(zip(containers, OBJECT_CONTAINERS)):
+            for result in results:
+                container.extend(fromstring(result[index]).find(tag))
+
+    def serialize(self) -> Tuple[bytes, bytes]:
+        """Set the version strings to the current target version and return the serialized
+        Document.xml and GuiDocument.xml."""
+        journal.set_attribute(self.document_xml, "ProgramVersion", str(self.target_version))
+        journal.set_attribute(self.gui_document_xml, "ProgramVersion", str(self.target_version))
+        with stage("serialize"):
+            return (
+                tostring(self.document_xml, encoding="utf-8"),
+                tostring(self.gui_document_xml, encoding="utf-8"),
+            )
+
+    def migrated_members(self, source: zipfile.ZipFile) -> Dict[str, bytes]:
+        """The serialized XML documents, the provenance and the transformed binary members, by
+        member name."""
+        document, gui_document = self.serialize()
+        provenance = Provenance.of(
+            self.source_version, self.target_version, self.applied, document, gui_document
+        )
+        members = {
+            "Document.xml": document,
+            "GuiDocument.xml": gui_document,
+            PROVENANCE_MEMBER: provenance.to_json(),
+        }
+        members.update(transform_members(source, self.member_transforms))
+        return members
+
+    def export(self, filename: Union[str, BinaryIO]):
+        """Write the modified FCStd file to the given file (a path, or a writable binary file
+        object)."""
+        with zipfile.ZipFile(self.freecad_file, "r") as z, stage("export"):
+            write_archives(z, [(filename, self.migrated_members(z))])
+
+    def export_versions(self, outputs: Dict[Version, Union[str, BinaryIO]]):
+        """Write the document at each of several versions to its own file, without re-reading or
+        re-parsing the source. The migration chain is walked once in each direction from the current
+        version, and the serialized XML is snapshotted at each requested version along the way. The
+        in-memory documents are left at one of the requested versions."""
+        start_version = self.current_version
+        newer = sorted(version for version in outputs if version >= start_version)
+        older = sorted((version for version in outputs if version < start_version), reverse=True)
+
+        # When going both ways, the changes made on the way up are journaled and rolled back
+        # before going down
+        changes = Journal()
+        start_transforms = list(self.member_transforms)
+        start_applied = list(self.applied)
+        snapshots = {}
+        with zipfile.ZipFile(self.freecad_file, "r") as z:
+            with changes if newer and older else nullcontext():
+                for version in newer:
+                    self.migrate_to(version)
+                    snapshots[version] = self.migrated_members(z)
+            if newer and older:
+                changes.rollback()
+                self.current_version = start_version
+                self.member_transforms = start_transforms
+                self.applied = start_applied
+            for version in older:
+                self.migrate_to(version)
+                snapshots[version] = self.migrated_members(z)
+
+            with stage("export"):
+                write_archives(
+                    z, [(filename, snapshots[version]) for version, filename in outputs.items()]
+                )
@@ -14,6 +14,7 @@ class AttachmentExtensionSupportToAttachmentSupport(Migrator):
     changed_in_freecad_version = Version("1.0")
     changed_on_date = date(2024, 3, 4)
     changed_in_hash = "a8ae56e06ab0c45205f1f185523c23fe99d5ce44"
+    object_local = True
 
     def forward(self, document_xml: Element, gui_document_xml: Element):
         Migrator.rename_property(document_xml, "Support", "AttachmentSupport")
@@ -1,13 +1,16 @@
 # SPDX-License-Identifier: LGPL-2.1-or-later
 
 from datetime import date
-from typing import Tuple
+from typing import Dict, Tuple
 
 from packaging.version import Version
 from xml.etree.ElementTree import Element
 
-from freecad.fcstdmigrator.migrator import Migrator
-from freecad.fcstdmigrator.xml_utilities import find_elements_by_type
+from freecad.fcstdmigrator.migrator import MemberTransform, Migrator
+from freecad.fcstdmigrator.xml_utilities import find_color_list_files, find_elements_by_type
+
+# Maps each byte value x to 255 - x
+_INVERT = bytes(255 - x for x in range(256))
 
 
 class ArchDraftColorTransparencyToAlpha(Migrator):
@@ -16,6 +19,7 @@ class ArchDraftColorTransparencyToAlpha(Migrator):
     changed_in_freecad_version = Version("1.1")
     changed_on_date = date(2024, 12, 9)
     changed_in_hash = "0607c555d6c56d1b617dc0d3a52431bef562c7dc"
+    object_local = True
 
     """Affected elements:
     ArchBuildingPart Transparency
@@ -32,14 +36,41 @@ class ArchDraftColorTransparencyToAlpha(Migrator):
         for color_element in color_elements:
             r, g, b, t = self.decode_color_from_packed_value(int(color_element.text))
             a = 1.0 - t
-            color_element.text = str(self.encode_color_to_packed_value((r, g, b, a)))
+            self.set_text(color_element, str(self.encode_color_to_packed_value((r, g, b, a))))
 
     def backward(self, document_xml: Element, gui_document_xml: Element):
         color_elements = find_elements_by_type(gui_document_xml, "App::PropertyColor")
         for color_element in color_elements:
             r, g, b, a = self.decode_color_from_packed_value(int(color_element.text))
             t = 1.0 - a
-            color_element.text = str(self.encode_color_to_packed_value((r, g, b, t)))
+            self.set_text(color_element, str(self.encode_color_to_packed_value((r, g, b, t))))
+
+    def forward_members(
+        self, document_xml: Element, gui_document_xml: Element
+    ) -> Dict[str, MemberTransform]:
+        """Color lists (e.g. DiffuseColor) are stored in their own binary members, whose fourth
+        components must be converted in the same way."""
+        return {
+            name: self.invert_color_list_fourth_component
+            for name in find_color_list_files(gui_document_xml)
+        }
+
+    def backward_members(
+        self, document_xml: Element, gui_document_xml: Element
+    ) -> Dict[str, MemberTransform]:
+        return {
+            name: self.invert_color_list_fourth_component
+            for name in find_color_list_files(gui_document_xml)
+        }
+
+    @staticmethod
+    def invert_color_list_fourth_component(colors: memoryview):
+        """Replace the fourth component x of every color in a color list member with 1 - x, in
+        place. The member holds a little-endian uint32 count followed by that many little-endian
+        packed colors, so the fourth component is the first byte of each color."""
+        count = int.from_bytes(colors[:4], "little")
+        end = min(4 + 4 * count, len(colors))
+        colors[4:end:4] = bytes(colors[4:end:4]).translate(_INVERT)
 
     @staticmethod
     def decode_color_from_packed_value(color: int) -> Tuple[float, float, float, float]:
@@ -1,11 +1,13 @@
 # SPDX-License-Identifier: LGPL-2.1-or-later
 
 from abc import ABC, ABCMeta, abstractmethod
-from typing import Callable
+from typing import Callable, Dict, List
 from xml.etree.ElementTree import Element
 from packaging.version import Version
 from datetime import date
 
+from . import journal
+
 
 class MigratorException(Exception):
     """Base class for all exceptions raised by migrators."""
@@ -17,6 +19,10 @@ class IncompatibleVersionException(MigratorException):
     Should never be raised by forward-migration code."""
 
 
+# Transforms the contents of a binary archive member in place
+MemberTransform = Callable[[memoryview], None]
+
+
 class MigratorMeta(ABCMeta):
     required_attrs = {
         "name": str,
@@ -49,6 +55,11 @@ class Migrator(ABC, metaclass=MigratorMeta):
     changed_on_date: date = date.today()
     changed_in_hash: str = ""
 
+    # Optional: set to True if the migration of each child of ObjectData (in Document.xml) and
+    # ViewProviderData (in GuiDocument.xml) depends only on that child itself. Such migrators may
+    # be run on chunks of a large document in parallel.
+    object_local: bool = False
+
     @abstractmethod
     def forward(self, document_xml: Element, gui_document_xml: Element):
         """Run a forward migration (e.g., upgrade from a previous version to a newer version)"""
@@ -58,12 +69,61 @@ class Migrator(ABC, metaclass=MigratorMeta):
         """Run a backward migration (e.g., downgrade from a newer version to a previous version).
         May raise an IncompatibleVersionException if the backward migration cannot be applied."""
 
+    # The helpers below record their edits in the active change journal (see journal.py), so that a
+    # migration that fails partway through can be rolled back. Migrators should make all of their
+    # edits through them.
+
+    def forward_members(
+        self, document_xml: Element, gui_document_xml: Element
+    ) -> Dict[str, MemberTransform]:
+        """Optional: the binary members of the FCStd archive (e.g. those referenced by the "file"
+        attribute of ColorList elements) that the forward migration also changes, each mapped to a
+        function that converts the member's contents in place, given as a writable memoryview.
+        Called with the documents once forward() has run. The members are only read and transformed
+        when the file is exported."""
+        return {}
+
+    def backward_members(
+        self, document_xml: Element, gui_document_xml: Element
+    ) -> Dict[str, MemberTransform]:
+        """Optional: as forward_members(), for the backward migration."""
+        return {}
+
+    def check_backward(self, document_xml: Element, gui_document_xml: Element) -> List[str]:
+        """Optional: cheaply check, without modifying anything, whether backward() would raise an
+        IncompatibleVersionException, and return a description of each object that blocks the
+        backward migration (an empty list if there are none). The check is given the documents at
+        their original version, before any other backward migration has been run on them.
+        Migrators whose backward() may raise should implement this, so that downgrades can be
+        probed without running the migration."""
+        return []
+
+    @staticmethod
+    def set_attribute(element: Element, name: str, value: str):
+        """Set an attribute of an element."""
+        journal.set_attribute(element, name, value)
+
+    @staticmethod
+    def set_text(element: Element, text: str):
+        """Set the text of an element."""
+        journal.set_text(element, text)
+
+    @staticmethod
+    def append_element(parent: Element, child: Element):
+        """Add an element as the last child of parent."""
+        journal.append_child(parent, child)
+
+    @staticmethod
+    def remove_element(parent: Element, child: Element):
+        """Remove a child element from parent."""
+        journal.remove_child(parent, child)
+
     @staticmethod
     def rename_property(root: Element, old_name: str, new_name: str):
         """Rename a property."""
         for prop in root.iter("Property"):
             if prop.get("name") == old_name:
-                prop.set("name", new_name)
+                journal.set_attribute(prop, "name", new_name)
 
     @staticmethod
     def change_property_type(
@@ -71,12 +131,17 @@ class Migrator(ABC, metaclass=MigratorMeta):
     ):
         for prop in root.iter("Property"):
             if prop.get("name") == name:
-                prop.set("type", new_type)
+                if transformation:
+                    journal.record_subtree(prop)
+                journal.set_attribute(prop, "type", new_type)
                 if transformation:
                     transformation(prop)
 
     @staticmethod
     def transform_property(root: Element, name: str, transformation: Callable):
+        """Apply a transformation to every property with the given name. The transformation may
+        edit the property element and its children directly."""
         for prop in root.iter("Property"):
             if prop.get("name") == name:
+                journal.record_subtree(prop)
                 transformation(prop)
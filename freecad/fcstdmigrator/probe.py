@@ -0,0 +1,92 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+
+# Downgrade compatibility probing: rather than running a backward migration to find out whether
+# it raises an IncompatibleVersionException, the cheap check_backward() of each migrator in the
+# backward plan is evaluated against the unmodified documents. Nothing is migrated or written, so
+# a whole corpus can be probed quickly: only the documents are parsed (GuiDocument.xml only if a
+# migrator has to be checked), and each worker process discovers the migrators once.
+
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, NamedTuple, Optional, Type
+
+from packaging.version import Version
+
+from .migrate import Migrate, backward_plan, discover_migrators, read_xml
+from .migrator import Migrator
+
+
+class Blocker(NamedTuple):
+    migrator: str
+    version: Version
+    reason: str
+
+
+class ProbeResult(NamedTuple):
+    freecad_file: str
+    original_version: Optional[Version]
+    target_version: Version
+    reachable_version: Optional[Version]
+    blockers: List[Blocker]
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        """Whether the file can be migrated all the way to the target version."""
+        return self.error is None and self.reachable_version == self.target_version
+
+
+def probe_downgrade(
+    freecad_file: str, target_version: Version, migrators: Optional[List[Type[Migrator]]] = None
+) -> ProbeResult:
+    """Find how far towards target_version the file can be downgraded. The reachable version is the
+    target version if nothing blocks the backward migration, or else the version of the newest
+    blocked migrator (i.e. the oldest version the file can be migrated to). The blockers of every
+    migrator in the plan are reported, not only those of the first blocked one. The available
+    migrators are discovered unless given, sorted as by discover_migrators()."""
+    with zipfile.ZipFile(freecad_file, "r") as z:
+        document_xml = read_xml(z, "Document.xml")
+        original_version = Migrate.extract_version_from_xml(document_xml)
+        if target_version >= original_version:
+            return ProbeResult(freecad_file, original_version, target_version, target_version, [])
+        if migrators is None:
+            migrators = discover_migrators()
+        plan = backward_plan(migrators, original_version, target_version)
+        gui_document_xml = read_xml(z, "GuiDocument.xml") if plan else None
+
+    reachable_version = target_version
+    blockers = []
+    for migrator in plan:
+        reasons = migrator().check_backward(document_xml, gui_document_xml)
+        if reasons and reachable_version == target_version:
+            reachable_version = migrator.changed_in_freecad_version
+        blockers.extend(
+            Blocker(migrator.name, migrator.changed_in_freecad_version, reason)
+            for reason in reasons
+        )
+    return ProbeResult(freecad_file, original_version, target_version, reachable_version, blockers)
+
+
+# The migrators available in a worker process, discovered once when the process starts
+_worker_migrators: Optional[List[Type[Migrator]]] = None
+
+
+def _init_worker():
+    global _worker_migrators
+    _worker_migrators = discover_migrators()
+
+
+def _probe_file(freecad_file: str, target_version: Version) -> ProbeResult:
+    try:
+        return probe_downgrade(freecad_file, target_version, _worker_migrators)
+    except Exception as e:
+        return ProbeResult(freecad_file, None, target_version, None, [], f"{type(e).__name__}: {e}")
+
+
+def probe_corpus(
+    freecad_files: List[str], target_version: Version, jobs: Optional[int] = None
+) -> List[ProbeResult]:
+    """Probe many files in parallel, using up to jobs worker processes (defaults to the number of
+    CPUs). Errors are reported per-file rather than aborting the run."""
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker) as executor:
+        return list(executor.map(_probe_file, freecad_files, [target_version] * len(freecad_files)))
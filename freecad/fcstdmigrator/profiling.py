@@ -0,0 +1,107 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+
+# A low-overhead sampling profiler. Code marks the pipeline stage it is in with the stage() context
+# manager (e.g. "parse", "export", or "migrator:<name>"), and while a SamplingProfiler is running it
+# periodically records the stack of every thread that is inside a stage, prefixed by that thread's
+# stage tags in square brackets. Samples are kept as collapsed stacks (the input format of flame
+# graph tools), which are plain counters and can be merged across threads, processes and runs.
+
+import os
+import sys
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Iterable, List
+
+# Stage tags of each thread, innermost last, keyed by thread identifier
+_stages: Dict[int, List[str]] = {}
+
+
+@contextmanager
+def stage(name: str):
+    """Tag everything the current thread does inside this context with the given stage name."""
+    ident = threading.get_ident()
+    tags = _stages.setdefault(ident, [])
+    tags.append(name)
+    try:
+        yield
+    finally:
+        tags.pop()
+        if not tags:
+            del _stages[ident]
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """Sample the stacks of all threads that are inside a stage() every interval seconds, from a
+    background thread. Use as a context manager, or call start() and stop(). The samples are
+    available afterwards as a Counter mapping collapsed stacks to sample counts."""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> Counter:
+        self._stop.set()
+        self._thread.join()
+        return self.samples
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                tags = tuple(_stages.get(ident, ()))
+                if not tags:
+                    continue
+                labels = [f"[{tag.replace(';', ',')}]" for tag in tags]
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                self.samples[";".join(labels + stack[::-1])] += 1
+
+
+def merge(profiles: Iterable[Counter]) -> Counter:
+    """Merge the samples of several profilers (e.g. one per worker process)."""
+    merged = Counter()
+    for profile in profiles:
+        merged.update(profile)
+    return merged
+
+
+def write_collapsed(samples: Counter, filename: str):
+    """Write samples in collapsed-stack format, one "frame;frame;... count" line per stack."""
+    with open(filename, "w", encoding="utf-8") as f:
+        for stack, count in sorted(samples.items()):
+            f.write(f"{stack} {count}\n")
+
+
+def stage_table(samples: Counter, top: int = 10) -> str:
+    """Summarize samples as a table of the top stages (including nested stages such as a migrator
+    within the migration stage) by number of samples."""
+    by_stage = Counter()
+    for stack, count in samples.items():
+        tags = [frame[1:-1] for frame in stack.split(";") if frame.startswith("[")]
+        by_stage[" > ".join(tags)] += count
+    total = sum(by_stage.values())
+    lines = [f"{'Samples':>8} {'%':>6}  Stage"]
+    for name, count in by_stage.most_common(top):
+        lines.append(f"{count:>8} {100 * count / total:6.1f}  {name}")
+    return "\n".join(lines)
@@ -0,0 +1,130 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+
+# Provenance of migrated files. Every exported file carries a small JSON member recording the
+# version it was originally migrated from, the version it was migrated to, and the migrators that
+# were applied on the way. When such a file is migrated again, only the migrators that were added
+# since (the "delta") need to be run, and a file that is already up to date can be skipped without
+# parsing it. The provenance also records the CRCs of the XML documents as written, so that it is
+# ignored if the file has since been modified (e.g. re-saved by FreeCAD).
+
+import json
+import zlib
+import zipfile
+from typing import List, NamedTuple, Optional, Sequence, Tuple, Type
+
+from packaging.version import InvalidVersion, Version
+
+from .migrator import Migrator
+
+PROVENANCE_MEMBER = "FCStdMigrator.json"
+PROVENANCE_FORMAT = 1
+
+
+class AppliedMigrator(NamedTuple):
+    name: str
+    changed_in_hash: str
+    changed_on_date: str
+    direction: str
+
+    @classmethod
+    def of(cls, migrator: Type[Migrator], direction: str) -> "AppliedMigrator":
+        return cls(
+            migrator.name,
+            migrator.changed_in_hash,
+            str(migrator.changed_on_date),
+            direction,
+        )
+
+    def is_migrator(self, migrator: Type[Migrator]) -> bool:
+        return (self.name, self.changed_in_hash) == (migrator.name, migrator.changed_in_hash)
+
+
+class Provenance(NamedTuple):
+    source_version: Version
+    target_version: Version
+    applied: List[AppliedMigrator]
+    document_crc: int
+    gui_document_crc: int
+
+    @classmethod
+    def of(
+        cls,
+        source_version: Version,
+        target_version: Version,
+        applied: Sequence[AppliedMigrator],
+        document: bytes,
+        gui_document: bytes,
+    ) -> "Provenance":
+        return cls(
+            source_version,
+            target_version,
+            list(applied),
+            zlib.crc32(document),
+            zlib.crc32(gui_document),
+        )
+
+    def to_json(self) -> bytes:
+        data = {
+            "format": PROVENANCE_FORMAT,
+            "source_version": str(self.source_version),
+            "target_version": str(self.target_version),
+            "applied": [applied._asdict() for applied in self.applied],
+            "document_crc": self.document_crc,
+            "gui_document_crc": self.gui_document_crc,
+        }
+        return json.dumps(data, indent=1).encode("utf-8")
+
+    @classmethod
+    def from_json(cls, data: bytes) -> "Provenance":
+        parsed = json.loads(data)
+        if parsed.get("format") != PROVENANCE_FORMAT:
+            raise ValueError("Unsupported provenance format")
+        return cls(
+            Version(parsed["source_version"]),
+            Version(parsed["target_version"]),
+            [AppliedMigrator(**applied) for applied in parsed["applied"]],
+            parsed["document_crc"],
+            parsed["gui_document_crc"],
+        )
+
+
+def read_provenance(source: zipfile.ZipFile) -> Optional[Provenance]:
+    """Read the provenance of an archive, reading no other member. Returns None if the archive has
+    no (readable) provenance, or if its XML documents have changed since it was written."""
+    try:
+        provenance = Provenance.from_json(source.read(PROVENANCE_MEMBER))
+        document_crc = source.getinfo("Document.xml").CRC
+        gui_document_crc = source.getinfo("GuiDocument.xml").CRC
+    except (KeyError, TypeError, ValueError, InvalidVersion):
+        return None
+    if (document_crc, gui_document_crc) != (provenance.document_crc, provenance.gui_document_crc):
+        return None
+    return provenance
+
+
+def missing_migrators(
+    provenance: Provenance, migrators: Sequence[Type[Migrator]]
+) -> Tuple[str, List[Type[Migrator]]]:
+    """The direction of the migration recorded in the provenance, and the migrators (in the order
+    they must be run) that belong to that migration but have not been applied, e.g. because they
+    were added since. migrators must be sorted by date."""
+    source, target = provenance.source_version, provenance.target_version
+    if target > source:
+        direction = "forward"
+        chain = [m for m in migrators if source < m.changed_in_freecad_version <= target]
+    else:
+        direction = "backward"
+        chain = [m for m in reversed(migrators) if target < m.changed_in_freecad_version <= source]
+    applied = [a for a in provenance.applied if a.direction == direction]
+    return direction, [m for m in chain if not any(a.is_migrator(m) for a in applied)]
+
+
+def is_up_to_date(
+    source: zipfile.ZipFile, target_version: Version, migrators: Sequence[Type[Migrator]]
+) -> bool:
+    """Whether the archive was exported at target_version with all of the migrators that apply, so
+    that migrating it again would change nothing."""
+    provenance = read_provenance(source)
+    if provenance is None or provenance.target_version != target_version:
+        return False
+    return not missing_migrators(provenance, migrators)[1]
@@ -0,0 +1,150 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+
+# Deterministic sharding of batch migrations across several machines sharing the same storage.
+# Every machine lists the same input directory and computes the same partition independently, so
+# no coordinator is needed: files are assigned to shards either by a stable hash of their path
+# relative to the input directory, or by balancing the total uncompressed size (taken from the zip
+# central directories) across the shards. Each shard writes a JSON manifest of its results, and the
+# manifests of all the shards can then be merged into one report.
+
+import hashlib
+import json
+import os
+import zipfile
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from .storage import LOCAL, Storage
+
+MANIFEST_FORMAT = 1
+
+
+def parse_shard(value: str) -> Tuple[int, int]:
+    """Parse a shard specification "i/N" (shard i of N, counting from 1) into (i, N)."""
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise ValueError(f"Invalid shard {value!r}, expected i/N, e.g. 1/4")
+    if not 1 <= index <= count:
+        raise ValueError(f"Invalid shard {value!r}, i must be between 1 and N")
+    return index, count
+
+
+def _path_hash(relative_path: str) -> int:
+    key = relative_path.replace(os.sep, "/").encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "big")
+
+
+def shard_by_path(relative_paths: Sequence[str], index: int, count: int) -> List[str]:
+    """The paths of shard index (of count), assigned by a stable hash of each path. A file stays in
+    the same shard however many other files are added or removed."""
+    return [path for path in relative_paths if _path_hash(path) % count == index - 1]
+
+
+def uncompressed_size(freecad_file: str, storage: Storage = LOCAL) -> int:
+    """The total uncompressed size of an archive's members, read from its central directory. Falls
+    back to the size of the file itself if it is not a readable zip file."""
+    try:
+        with storage.open_read(freecad_file) as f, zipfile.ZipFile(f, "r") as z:
+            return sum(info.file_size for info in z.infolist())
+    except (OSError, zipfile.BadZipFile):
+        return storage.size(freecad_file)
+
+
+def shard_by_size(sizes: Dict[str, int], index: int, count: int) -> List[str]:
+    """The paths of shard index (of count), assigned so that the shards' total sizes are balanced:
+    largest first, each file goes to the shard with the smallest total so far (ties are broken by
+    path and shard number, so every machine computes the same partition)."""
+    totals = [0] * count
+    shard = []
+    for path in sorted(sizes, key=lambda path: (-sizes[path], path)):
+        smallest = min(range(count), key=lambda i: (totals[i], i))
+        totals[smallest] += sizes[path]
+        if smallest == index - 1:
+            shard.append(path)
+    return sorted(shard)
+
+
+class ManifestEntry(NamedTuple):
+    path: str
+    error: Optional[str] = None
+    killed: bool = False
+
+
+class Manifest(NamedTuple):
+    shard: int
+    shards: int
+    target_version: str
+    elapsed: float
+    entries: List[ManifestEntry]
+
+
+def write_manifest(filename: str, manifest: Manifest):
+    data = {
+        "format": MANIFEST_FORMAT,
+        "shard": manifest.shard,
+        "shards": manifest.shards,
+        "target_version": manifest.target_version,
+        "elapsed": manifest.elapsed,
+        "files": [entry._asdict() for entry in manifest.entries],
+    }
+    with open(filename, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=1)
+
+
+def read_manifest(filename: str) -> Manifest:
+    with open(filename, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if data.get("format") != MANIFEST_FORMAT:
+        raise ValueError(f"{filename} is not a shard manifest in a supported format")
+    return Manifest(
+        data["shard"],
+        data["shards"],
+        data["target_version"],
+        data["elapsed"],
+        [ManifestEntry(**entry) for entry in data["files"]],
+    )
+
+
+class MergedReport(NamedTuple):
+    shards: int
+    missing_shards: List[int]
+    entries: List[ManifestEntry]
+    elapsed: float
+
+    def summary(self) -> str:
+        failed = sum(1 for entry in self.entries if entry.error is not None)
+        killed = sum(1 for entry in self.entries if entry.killed)
+        lines = [
+            f"Migrated {len(self.entries) - failed} of {len(self.entries)} file(s) in "
+            f"{self.shards - len(self.missing_shards)} of {self.shards} shard(s) "
+            f"(longest shard {self.elapsed:.2f}s), {failed} failed ({killed} killed for exceeding "
+            "limits)"
+        ]
+        if self.missing_shards:
+            missing = ", ".join(str(shard) for shard in self.missing_shards)
+            lines.append(f"  Missing manifests for shard(s) {missing}")
+        return "\n".join(lines)
+
+
+def merge_manifests(manifests: Sequence[Manifest]) -> MergedReport:
+    """Merge the manifests of the shards of one sharded run into a single report."""
+    if not manifests:
+        raise ValueError("No manifests to merge")
+    shards = manifests[0].shards
+    target_version = manifests[0].target_version
+    seen = set()
+    for manifest in manifests:
+        if manifest.shards != shards or manifest.target_version != target_version:
+            raise ValueError("The manifests are not all from the same sharded run")
+        if manifest.shard in seen:
+            raise ValueError(f"More than one manifest for shard {manifest.shard}")
+        seen.add(manifest.shard)
+    entries = sorted(
+        (entry for manifest in manifests for entry in manifest.entries), key=lambda e: e.path
+    )
+    return MergedReport(
+        shards,
+        [shard for shard in range(1, shards + 1) if shard not in seen],
+        entries,
+        max(manifest.elapsed for manifest in manifests),
+    )
@@ -0,0 +1,506 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+
+# Storage backends for the files read and written by the migrator: the local filesystem, and
+# S3-compatible object stores (e.g. AWS S3 or MinIO). Files are opened as binary file objects, so
+# that zipfile reads only what it needs from them: an object opened for reading is seekable and
+# fetches byte ranges on demand (with some read-ahead), so that reading the zip central directory
+# and the XML members of an archive does not download the whole object. An object opened for
+# writing is uploaded as it is written, in parts, once it is large enough to need more than one.
+#
+# Locations are given as local paths or as s3://bucket/key URLs. The S3 endpoint and credentials
+# are taken from the usual environment variables (AWS_ENDPOINT_URL, AWS_ACCESS_KEY_ID,
+# AWS_SECRET_ACCESS_KEY and AWS_REGION). Requests are signed with AWS Signature Version 4 and sent
+# over a pool of persistent HTTP connections, using only the standard library.
+
+import datetime
+import errno
+import hashlib
+import hmac
+import http.client
+import io
+import os
+import pathlib
+import queue
+import threading
+from abc import ABC, abstractmethod
+from typing import BinaryIO, Dict, List, Optional, Tuple
+from urllib.parse import quote, urlsplit
+
+from defusedxml.ElementTree import fromstring
+
+# Hash of an empty request body
+EMPTY_SHA256 = hashlib.sha256(b"").hexdigest()
+
+# Requests that can safely be sent again if it is unknown whether the server acted on them
+IDEMPOTENT_METHODS = frozenset(("GET", "HEAD", "PUT", "DELETE"))
+
+# How a connection that the server closed while it was idle in the pool fails when it is reused
+# (a timeout is not one of them: the server may still be working on the request)
+_CLOSED_CONNECTION_ERRORS = (BrokenPipeError, ConnectionResetError, ConnectionAbortedError)
+
+
+class StorageError(OSError):
+    """Raised when an object store rejects a request."""
+
+
+class Storage(ABC):
+    """A place to read input files from and write output files to."""
+
+    @abstractmethod
+    def open_read(self, path: str) -> BinaryIO:
+        """Open a file for reading, as a seekable binary file object."""
+
+    @abstractmethod
+    def open_write(self, path: str) -> BinaryIO:
+        """Open a file for writing, as a binary file object. Use it as a context manager: the file
+        is only complete once the with block is left without an exception. Remote files are
+        discarded if they are closed any other way (e.g. garbage-collected on an error path)."""
+
+    @abstractmethod
+    def size(self, path: str) -> int:
+        """The size of a file, in bytes."""
+
+    @abstractmethod
+    def list_files(self, directory: str, suffix: str) -> List[str]:
+        """The paths, relative to directory, of the files below it whose names end with suffix
+        (compared case-insensitively), in a stable order."""
+
+    @abstractmethod
+    def join(self, directory: str, relative_path: str) -> str:
+        """The path of a file relative to directory."""
+
+
+class LocalStorage(Storage):
+    """The local filesystem."""
+
+    def open_read(self, path: str) -> BinaryIO:
+        return open(path, "rb")
+
+    def open_write(self, path: str) -> BinaryIO:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        return open(path, "wb")
+
+    def size(self, path: str) -> int:
+        return os.path.getsize(path)
+
+    def list_files(self, directory: str, suffix: str) -> List[str]:
+        root = pathlib.Path(directory)
+        return sorted(
+            path.relative_to(root).as_posix()
+            for path in root.rglob("*")
+            if path.name.lower().endswith(suffix.lower()) and path.is_file()
+        )
+
+    def join(self, directory: str, relative_path: str) -> str:
+        return os.path.join(directory, relative_path)
+
+
+def _hmac(key: bytes, message: str) -> bytes:
+    return hmac.new(key, message.encode("utf-8"), hashlib.sha256).digest()
+
+
+def _quote(value: str, safe: str = "-_.~") -> str:
+    return quote(value, safe=safe)
+
+
+def sign_v4(
+    method: str,
+    host: str,
+    uri: str,
+    query: Dict[str, str],
+    headers: Dict[str, str],
+    payload_hash: str,
+    access_key: str,
+    secret_key: str,
+    region: str,
+    timestamp: datetime.datetime,
+    service: str = "s3",
+) -> Dict[str, str]:
+    """Sign a request with AWS Signature Version 4. Returns all the headers to send: the given
+    headers, plus host, x-amz-date, x-amz-content-sha256 and authorization. uri must already be
+    URI-encoded."""
+    amz_date = timestamp.strftime("%Y%m%dT%H%M%SZ")
+    scope_date = timestamp.strftime("%Y%m%d")
+    signed = {name.lower(): str(value).strip() for name, value in headers.items()}
+    signed.update({"host": host, "x-amz-date": amz_date, "x-amz-content-sha256": payload_hash})
+    signed_headers = ";".join(sorted(signed))
+    canonical_request = "\n".join(
+        [
+            method,
+            uri,
+            "&".join(f"{_quote(k)}={_quote(v)}" for k, v in sorted(query.items())),
+            "".join(f"{name}:{signed[name]}\n" for name in sorted(signed)),
+            signed_headers,
+            payload_hash,
+        ]
+    )
+    scope = f"{scope_date}/{region}/{service}/aws4_request"
+    string_to_sign = "\n".join(
+        [
+            "AWS4-HMAC-SHA256",
+            amz_date,
+            scope,
+            hashlib.sha256(canonical_request.encode("utf-8")).hexdigest(),
+        ]
+    )
+    key = _hmac(("AWS4" + secret_key).encode("utf-8"), scope_date)
+    for part in (region, service, "aws4_request"):
+        key = _hmac(key, part)
+    signature = hmac.new(key, string_to_sign.encode("utf-8"), hashlib.sha256).hexdigest()
+    signed["authorization"] = (
+        f"AWS4-HMAC-SHA256 Credential={access_key}/{scope}, "
+        f"SignedHeaders={signed_headers}, Signature={signature}"
+    )
+    return signed
+
+
+def _local_name(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+def _find_text(root, name: str) -> Optional[str]:
+    for element in root.iter():
+        if _local_name(element.tag) == name:
+            return element.text
+    return None
+
+
+class S3Storage(Storage):
+    """One bucket of an S3-compatible object store, addressed path-style (as MinIO expects). Paths
+    are object keys. At most pool_size requests are in flight at once, over persistent
+    connections that are shared by all threads. Objects being written are uploaded in parts of
+    part_size bytes once they grow beyond that size, and objects being read are fetched in ranges
+    of at least read_ahead bytes. timeout (in seconds) applies to each socket operation."""
+
+    def __init__(
+        self,
+        endpoint: str,
+        bucket: str,
+        access_key: str,
+        secret_key: str,
+        region: str = "us-east-1",
+        pool_size: int = 8,
+        part_size: int = 8 * 1024 * 1024,
+        read_ahead: int = 256 * 1024,
+        timeout: float = 60,
+    ):
+        parts = urlsplit(endpoint)
+        if parts.scheme not in ("http", "https") or not parts.netloc:
+            raise ValueError(f"Invalid S3 endpoint {endpoint!r}")
+        self.secure = parts.scheme == "https"
+        self.host = parts.netloc
+        self.bucket = bucket
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.part_size = part_size
+        self.read_ahead = read_ahead
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(pool_size)
+
+    def _connect(self) -> http.client.HTTPConnection:
+        if self.secure:
+            return http.client.HTTPSConnection(self.host, timeout=self.timeout)
+        return http.client.HTTPConnection(self.host, timeout=self.timeout)
+
+    def request(
+        self,
+        method: str,
+        key: str = "",
+        query: Optional[Dict[str, str]] = None,
+        headers: Optional[Dict[str, str]] = None,
+        body: bytes = b"",
+    ) -> Tuple[int, Dict[str, str], bytes]:
+        """Send a signed request for an object (or for the bucket, if key is empty) and return the
+        status, the headers (with lower-case names) and the body of the response. A 404 response
+        raises FileNotFoundError and other error responses raise StorageError."""
+        query = query or {}
+        uri = _quote(f"/{self.bucket}/{key}" if key else f"/{self.bucket}", safe="/-_.~")
+        payload_hash = hashlib.sha256(body).hexdigest() if body else EMPTY_SHA256
+        signed = sign_v4(
+            method,
+            self.host,
+            uri,
+            query,
+            headers or {},
+            payload_hash,
+            self.access_key,
+            self.secret_key,
+            self.region,
+            datetime.datetime.now(datetime.timezone.utc),
+        )
+        url = uri
+        if query:
+            url += "?" + "&".join(f"{_quote(k)}={_quote(v)}" for k, v in sorted(query.items()))
+
+        # The server may close a connection while it is idle in the pool, which is only noticed
+        # when the connection is reused. Such a failure is retried (on the next idle connection, or
+        # a new one), but only for idempotent requests: since the server may have acted on the
+        # request before closing the connection, the others are always sent on a new connection and
+        # never retried. No failure of a new connection is retried either.
+        idempotent = method in IDEMPOTENT_METHODS
+        with self._slots:
+            while True:
+                connection = None
+                if idempotent:
+                    try:
+                        connection = self._idle.get_nowait()
+                    except queue.Empty:
+                        pass
+                reused = connection is not None
+                if not reused:
+                    connection = self._connect()
+                try:
+                    connection.request(method, url, body=body, headers=signed)
+                    response = connection.getresponse()
+                    data = response.read()
+                except (http.client.HTTPException, OSError) as e:
+                    connection.close()
+                    if reused and isinstance(e, _CLOSED_CONNECTION_ERRORS):
+                        continue
+                    raise
+                if response.will_close:
+                    connection.close()
+                else:
+                    self._idle.put(connection)
+                break
+
+        response_headers = {name.lower(): value for name, value in response.getheaders()}
+        if response.status == 404:
+            raise FileNotFoundError(f"s3://{self.bucket}/{key} not found")
+        if response.status >= 300:
+            message = response.reason
+            if data:
+                try:
+                    message = _find_text(fromstring(data), "Message") or message
+                except Exception:
+                    pass
+            raise StorageError(f"{method} s3://{self.bucket}/{key}: {response.status} {message}")
+        return response.status, response_headers, data
+
+    def open_read(self, path: str) -> BinaryIO:
+        return S3ReadFile(self, path)
+
+    def open_write(self, path: str) -> BinaryIO:
+        return S3WriteFile(self, path)
+
+    def size(self, path: str) -> int:
+        _, headers, _ = self.request("HEAD", path)
+        return int(headers["content-length"])
+
+    def list_files(self, directory: str, suffix: str) -> List[str]:
+        prefix = directory.rstrip("/") + "/" if directory.strip("/") else ""
+        keys = []
+        token = None
+        while True:
+            query = {"list-type": "2", "prefix": prefix}
+            if token is not None:
+                query["continuation-token"] = token
+            _, _, data = self.request("GET", query=query)
+            root = fromstring(data)
+            for element in root.iter():
+                if _local_name(element.tag) == "Key" and element.text.lower().endswith(
+                    suffix.lower()
+                ):
+                    keys.append(element.text[len(prefix) :])
+            if _find_text(root, "IsTruncated") != "true":
+                return sorted(keys)
+            token = _find_text(root, "NextContinuationToken")
+
+    def join(self, directory: str, relative_path: str) -> str:
+        directory = directory.strip("/")
+        return f"{directory}/{relative_path}" if directory else relative_path
+
+
+class S3ReadFile(io.RawIOBase):
+    """A seekable, read-only view of an object, fetched with range requests as it is read. The
+    most recently fetched range is kept, so small reads close to each other need one request."""
+
+    def __init__(self, storage: S3Storage, key: str):
+        super().__init__()
+        self.storage = storage
+        self.key = key
+        self.name = f"s3://{storage.bucket}/{key}"
+        self.length = storage.size(key)
+        self._position = 0
+        self._buffer = b""
+        self._buffer_start = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self.length
+        if offset < 0:
+            raise OSError(errno.EINVAL, "negative seek position")
+        self._position = offset
+        return offset
+
+    def _fetch(self, start: int, end: int) -> bytes:
+        _, _, data = self.storage.request(
+            "GET", self.key, headers={"Range": f"bytes={start}-{end - 1}"}
+        )
+        return data
+
+    def readinto(self, buffer) -> int:
+        start = self._position
+        end = min(self.length, start + len(buffer))
+        if start >= end:
+            return 0
+        buffer_end = self._buffer_start + len(self._buffer)
+        if not self._buffer_start <= start < end <= buffer_end:
+            fetch_end = min(self.length, max(end, start + self.storage.read_ahead))
+            self._buffer = self._fetch(start, fetch_end)
+            self._buffer_start = start
+        offset = start - self._buffer_start
+        count = end - start
+        memoryview(buffer)[:count] = self._buffer[offset : offset + count]
+        self._position = end
+        return count
+
+    def readall(self) -> bytes:
+        """Read everything from the current position in one request."""
+        if self._position >= self.length:
+            return b""
+        data = self._fetch(self._position, self.length)
+        self._position = self.length
+        return data
+
+
+class S3WriteFile(io.RawIOBase):
+    """A write-only stream that uploads an object, as a multipart upload while it is written if the
+    object is larger than the storage's part size. The object is only created by commit(), which
+    leaving a with block without an exception calls. Closing the stream without committing it
+    (including when it is garbage-collected) discards everything written, and aborts any multipart
+    upload, so that no truncated object is ever published."""
+
+    def __init__(self, storage: S3Storage, key: str):
+        super().__init__()
+        self.storage = storage
+        self.key = key
+        self.name = f"s3://{storage.bucket}/{key}"
+        self._buffer = bytearray()
+        self._written = 0
+        self._upload_id = None
+        self._parts: List[Tuple[int, str]] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._written
+
+    def write(self, data) -> int:
+        if self.closed:
+            raise ValueError("write to closed file")
+        self._buffer += data
+        count = len(data) if not isinstance(data, memoryview) else data.nbytes
+        self._written += count
+        while len(self._buffer) >= self.storage.part_size:
+            part = bytes(self._buffer[: self.storage.part_size])
+            del self._buffer[: self.storage.part_size]
+            self._upload_part(part)
+        return count
+
+    def _upload_part(self, data: bytes):
+        if self._upload_id is None:
+            _, _, response = self.storage.request("POST", self.key, query={"uploads": ""})
+            self._upload_id = _find_text(fromstring(response), "UploadId")
+        number = len(self._parts) + 1
+        query = {"partNumber": str(number), "uploadId": self._upload_id}
+        _, headers, _ = self.storage.request("PUT", self.key, query=query, body=data)
+        self._parts.append((number, headers.get("etag", "")))
+
+    def commit(self):
+        """Create the object from everything written, and close the stream. If that fails, the
+        stream is closed (and the object discarded) before the error is raised."""
+        if self.closed:
+            raise ValueError("commit of closed file")
+        try:
+            self._finish()
+        except BaseException:
+            try:
+                self.close()
+            except Exception:
+                pass  # The error that made the commit fail is the one to report
+            raise
+        self._upload_id = None
+        self.close()
+
+    def abort(self):
+        """Discard everything written so far, and close the stream."""
+        self.close()
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self._upload_id is not None:
+                upload_id, self._upload_id = self._upload_id, None
+                self.storage.request("DELETE", self.key, query={"uploadId": upload_id})
+        finally:
+            super().close()
+
+    def _finish(self):
+        if self._upload_id is None:
+            self.storage.request("PUT", self.key, body=bytes(self._buffer))
+            return
+        if self._buffer or not self._parts:
+            self._upload_part(bytes(self._buffer))
+        parts = "".join(
+            f"<Part><PartNumber>{number}</PartNumber><ETag>{etag}</ETag></Part>"
+            for number, etag in self._parts
+        )
+        body = f"<CompleteMultipartUpload>{parts}</CompleteMultipartUpload>".encode("utf-8")
+        self.storage.request("POST", self.key, query={"uploadId": self._upload_id}, body=body)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None and not self.closed:
+            self.commit()
+        else:
+            self.close()
+
+
+LOCAL = LocalStorage()
+
+# S3 storages by bucket, so that their connections are shared
+_s3_storages: Dict[str, S3Storage] = {}
+_s3_lock = threading.Lock()
+
+
+def is_remote(location: str) -> bool:
+    return str(location).startswith("s3://")
+
+
+def open_location(location: str) -> Tuple[Storage, str]:
+    """Split a location (a local path, or an s3://bucket/key URL) into its storage and the path
+    within that storage."""
+    location = str(location)
+    if not is_remote(location):
+        return LOCAL, location
+    bucket, _, key = location[len("s3://") :].partition("/")
+    if not bucket:
+        raise ValueError(f"Invalid S3 location {location!r}")
+    with _s3_lock:
+        if bucket not in _s3_storages:
+            try:
+                _s3_storages[bucket] = S3Storage(
+                    os.environ.get("AWS_ENDPOINT_URL", "https://s3.amazonaws.com"),
+                    bucket,
+                    os.environ["AWS_ACCESS_KEY_ID"],
+                    os.environ["AWS_SECRET_ACCESS_KEY"],
+                    os.environ.get("AWS_REGION", "us-east-1"),
+                )
+            except KeyError as e:
+                raise ValueError(f"{e.args[0]} must be set to access {location}")
+        return _s3_storages[bucket], key
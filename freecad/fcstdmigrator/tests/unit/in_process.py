@@ -0,0 +1,13 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+
+from contextlib import contextmanager
+from unittest import mock
+
+
+@contextmanager
+def executor_in_process(module: str):
+    """Replace the ProcessPoolExecutor of a module with one whose map() runs in-process, so that
+    mocks (e.g. of the migrator discovery) apply to the work it is given."""
+    with mock.patch(f"{module}.ProcessPoolExecutor") as executor:
+        executor.return_value.__enter__.return_value.map = map
+        yield executor
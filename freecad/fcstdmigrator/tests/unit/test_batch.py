@@ -0,0 +1,304 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+
+import os
+import threading
+import time
+import unittest
+from unittest import mock
+import tempfile
+import zipfile
+import pathlib
+from collections import Counter
+from xml.etree.ElementTree import fromstring
+from packaging.version import Version
+
+from freecad.fcstdmigrator import batch
+from freecad.fcstdmigrator.batch import (
+    BatchItem,
+    BatchMigrate,
+    MemoryBudget,
+    QueueStats,
+    StageStats,
+    _migrate_in_worker,
+    estimate_memory,
+)
+
+
+def _die(*args):
+    os._exit(1)
+
+
+def _die_on_marker(data, *args):
+    """Kill the worker process on files containing a marker, and keep the others in flight for a
+    while."""
+    if b"crash" in data:
+        time.sleep(0.1)
+        os._exit(1)
+    time.sleep(0.3)
+    return _migrate_in_worker(data, *args)
+
+
+class TestBatchMigrate(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self.tmpdir.name)
+        self.items = []
+        for index in range(6):
+            source = self.root / "in" / f"file{index}.FCStd"
+            source.parent.mkdir(exist_ok=True)
+            with zipfile.ZipFile(source, "w") as z:
+                z.writestr("Document.xml", '<Document ProgramVersion="1.0"/>')
+                z.writestr("GuiDocument.xml", '<GuiDocument ProgramVersion="1.0"/>')
+                z.writestr("PartShape.brp", f"shape {index}")
+            destination = self.root / "out" / "nested" / f"file{index}.FCStd"
+            self.items.append(BatchItem(str(source), str(destination)))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_migrates_all_files(self):
+        report = BatchMigrate(self.items, Version("1.1"), jobs=2, queue_depth=1).run()
+
+        self.assertEqual(
+            [result.source for result in report.results], [i.source for i in self.items]
+        )
+        self.assertTrue(all(result.ok for result in report.results))
+        for index, item in enumerate(self.items):
+            with zipfile.ZipFile(item.destination, "r") as z:
+                doc = fromstring(z.read("Document.xml"))
+                self.assertEqual(doc.attrib["ProgramVersion"], "1.1")
+                self.assertEqual(z.read("PartShape.brp"), f"shape {index}".encode())
+        self.assertEqual(report.stages["read"].items, 6)
+        self.assertEqual(report.stages["migrate"].items, 6)
+        self.assertEqual(report.stages["write"].items, 6)
+        self.assertLessEqual(report.queues["read"].max, 1)
+        self.assertIn("Migrated 6 of 6 file(s)", report.summary())
+
+    def test_failures_are_reported_per_file(self):
+        pathlib.Path(self.items[1].source).write_bytes(b"not a zip file")
+        missing = BatchItem(str(self.root / "missing.FCStd"), str(self.root / "out" / "m.FCStd"))
+        report = BatchMigrate(self.items + [missing], Version("1.1"), jobs=2).run()
+
+        failed = [result.source for result in report.results if not result.ok]
+        self.assertEqual(failed, [self.items[1].source, missing.source])
+        self.assertTrue(pathlib.Path(self.items[0].destination).is_file())
+        self.assertFalse(pathlib.Path(self.items[1].destination).exists())
+
+    def test_up_to_date_files_are_copied_unchanged(self):
+        BatchMigrate(self.items, Version("1.1"), jobs=2).run()
+        remigrate = [
+            BatchItem(item.destination, item.destination.replace("out", "again"))
+            for item in self.items
+        ]
+        report = BatchMigrate(remigrate, Version("1.1"), jobs=2).run()
+        self.assertTrue(all(result.ok and result.skipped for result in report.results))
+        self.assertIn("6 file(s) were already up to date", report.summary())
+        for item in remigrate:
+            self.assertEqual(
+                pathlib.Path(item.source).read_bytes(), pathlib.Path(item.destination).read_bytes()
+            )
+
+        report = BatchMigrate(remigrate, Version("1.1"), jobs=2, skip_up_to_date=False).run()
+        self.assertFalse(any(result.skipped for result in report.results))
+
+    def test_identical_members_are_deduplicated(self):
+        for item in self.items:
+            with zipfile.ZipFile(item.source, "a") as z:
+                z.writestr("Standard.brp", "standard part " * 100)
+        report = BatchMigrate(self.items, Version("1.1"), jobs=2).run()
+
+        self.assertEqual(report.dedup.members, 12)
+        self.assertEqual(report.dedup.duplicates, 5)
+        self.assertIn("5 of 12 copied member(s) were duplicates", report.summary())
+        for item in self.items:
+            with zipfile.ZipFile(item.destination, "r") as z:
+                self.assertEqual(z.read("Standard.brp"), b"standard part " * 100)
+
+        report = BatchMigrate(self.items, Version("1.1"), jobs=2, dedup_cache_size=0).run()
+        self.assertIsNone(report.dedup)
+
+    def test_compression_does_not_depend_on_the_cache(self):
+        with zipfile.ZipFile(self.items[0].source, "a", zipfile.ZIP_DEFLATED) as z:
+            z.writestr("Thumbnails/Thumbnail.png", b"png" * 1000)
+        compress_types = []
+        for dedup_cache_size in (0, 1024 * 1024):
+            BatchMigrate(self.items[:1], Version("1.1"), dedup_cache_size=dedup_cache_size).run()
+            with zipfile.ZipFile(self.items[0].destination, "r") as z:
+                compress_types.append({info.filename: info.compress_type for info in z.infolist()})
+        self.assertEqual(compress_types[0], compress_types[1])
+        self.assertEqual(compress_types[0]["PartShape.brp"], zipfile.ZIP_STORED)
+        self.assertEqual(compress_types[0]["Thumbnails/Thumbnail.png"], zipfile.ZIP_DEFLATED)
+
+    def test_profile_is_collected_on_request(self):
+        report = BatchMigrate(self.items, Version("1.1"), jobs=2).run()
+        self.assertIsNone(report.profile)
+
+        report = BatchMigrate(self.items, Version("1.1"), jobs=2, profile=True).run()
+        self.assertIsInstance(report.profile, Counter)
+        for stack in report.profile:
+            self.assertRegex(stack, r"^\[(read|migrate|write)\]")
+
+    def test_empty_batch(self):
+        report = BatchMigrate([], Version("1.1")).run()
+        self.assertEqual(report.results, [])
+
+    def test_memory_budget_schedules_largest_first(self):
+        big = pathlib.Path(self.items[3].source)
+        with zipfile.ZipFile(big, "w") as z:
+            z.writestr(
+                "Document.xml", '<Document ProgramVersion="1.0">' + " " * 100000 + "</Document>"
+            )
+            z.writestr("GuiDocument.xml", '<GuiDocument ProgramVersion="1.0"/>')
+        read_order = []
+        real_open = open
+
+        def recording_open(file, *args, **kwargs):
+            if str(file).endswith(".FCStd") and "rb" in args:
+                read_order.append(str(file))
+            return real_open(file, *args, **kwargs)
+
+        engine = BatchMigrate(self.items, Version("1.1"), jobs=1, readers=1, memory_budget=1)
+        with mock.patch("builtins.open", recording_open):
+            report = engine.run()
+        self.assertTrue(all(result.ok for result in report.results))
+        # Every file is opened once for its memory estimate before any is read
+        self.assertEqual(read_order[len(self.items)], str(big))
+
+    def test_memory_estimates_are_concurrent(self):
+        # Fails unless the estimates of two files are in progress at the same time
+        both = threading.Barrier(2, timeout=5)
+
+        def estimate(source, storage):
+            both.wait()
+            return 1
+
+        with mock.patch.object(batch, "estimate_memory", side_effect=estimate):
+            report = BatchMigrate(self.items, Version("1.1"), readers=2, memory_budget=10).run()
+        self.assertTrue(all(result.ok for result in report.results))
+
+    def test_time_limit_kills_file(self):
+        if not hasattr(os, "fork"):
+            self.skipTest("per-file time limits need SIGALRM")
+        objects = "".join(f'<Object name="Box{i}"/>' for i in range(200000))
+        with zipfile.ZipFile(self.items[0].source, "w") as z:
+            z.writestr("Document.xml", f'<Document ProgramVersion="1.0">{objects}</Document>')
+            z.writestr("GuiDocument.xml", '<GuiDocument ProgramVersion="1.0"/>')
+        report = BatchMigrate(self.items[:2], Version("1.1"), jobs=1, file_time_limit=0.001).run()
+        self.assertTrue(report.results[0].killed, report.results)
+        self.assertIn("time limit", report.results[0].error)
+
+    def test_dead_worker_is_reported_as_killed(self):
+        with mock.patch.object(batch, "_migrate_in_worker", _die):
+            report = BatchMigrate(self.items[:2], Version("1.1"), jobs=1).run()
+        self.assertTrue(all(result.killed for result in report.results))
+        self.assertIn("killed", report.summary())
+
+    def test_only_the_file_that_kills_its_worker_is_reported(self):
+        with zipfile.ZipFile(self.items[0].source, "a") as z:
+            z.writestr("Marker.txt", "crash")
+        with mock.patch.object(batch, "_migrate_in_worker", _die_on_marker):
+            report = BatchMigrate(self.items[:4], Version("1.1"), jobs=2).run()
+        self.assertTrue(report.results[0].killed, report.results)
+        self.assertTrue(all(result.ok for result in report.results[1:]), report.results)
+
+    def test_all_sources_unreadable(self):
+        items = [
+            BatchItem(str(self.root / "missing" / f"file{index}.FCStd"), item.destination)
+            for index, item in enumerate(self.items)
+        ]
+        report = BatchMigrate(items, Version("1.1"), jobs=1).run()
+        self.assertEqual(len(report.results), len(items))
+        self.assertTrue(all(result.error and not result.killed for result in report.results))
+        self.assertEqual(report.stages["migrate"].items, 0)
+
+    def test_workers_are_recycled(self):
+        replace = BatchMigrate._replace_executor
+        with mock.patch.object(
+            BatchMigrate, "_replace_executor", autospec=True, side_effect=replace
+        ) as replaced:
+            report = BatchMigrate(self.items, Version("1.1"), jobs=2, max_files_per_worker=1).run()
+        self.assertTrue(all(result.ok for result in report.results))
+        # The first pool, then a new one after every two files
+        self.assertEqual(replaced.call_count, 3)
+
+        with mock.patch.object(
+            BatchMigrate, "_replace_executor", autospec=True, side_effect=replace
+        ) as replaced:
+            BatchMigrate(self.items, Version("1.1"), jobs=2).run()
+        self.assertEqual(replaced.call_count, 1)
+
+    @mock.patch("freecad.fcstdmigrator.migrate.find_migrator_subclasses")
+    def test_worker_discovers_migrators_once(self, mock_find):
+        data = pathlib.Path(self.items[0].source).read_bytes()
+        with mock.patch.object(batch, "_worker_migrators", None), mock.patch.object(
+            batch, "discover_migrators", return_value=[]
+        ) as discover:
+            batch._init_worker()
+            for _ in range(3):
+                members, _, _ = batch._migrate_in_worker(data, Version("1.1"))
+                self.assertIn("Document.xml", members)
+        discover.assert_called_once()
+        mock_find.assert_not_called()
+
+    def test_memory_limit_kills_file(self):
+        if batch.resource is None:
+            self.skipTest("per-file memory limits need the resource module")
+        objects = "".join(f'<Object name="Box{i}"/>' for i in range(200000))
+        with zipfile.ZipFile(self.items[0].source, "w") as z:
+            z.writestr("Document.xml", f'<Document ProgramVersion="1.0">{objects}</Document>')
+            z.writestr("GuiDocument.xml", '<GuiDocument ProgramVersion="1.0"/>')
+        report = BatchMigrate(self.items[:2], Version("1.1"), jobs=1, file_memory_limit=1).run()
+        self.assertTrue(report.results[0].killed, report.results)
+        self.assertIn("memory limit", report.results[0].error)
+        self.assertTrue(report.results[1].ok, report.results)
+
+
+class TestMemoryEstimates(unittest.TestCase):
+    def test_estimate_uses_uncompressed_xml_size(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = pathlib.Path(tmpdir) / "test.FCStd"
+            with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as z:
+                z.writestr("Document.xml", " " * 100000)
+                z.writestr("GuiDocument.xml", " " * 1000)
+            self.assertEqual(
+                estimate_memory(str(path)),
+                2 * path.stat().st_size + batch.XML_MEMORY_FACTOR * 101000,
+            )
+
+    def test_budget_blocks_until_released(self):
+        budget = MemoryBudget(100)
+        budget.acquire(80)
+        acquired = threading.Event()
+
+        def acquire():
+            budget.acquire(50)
+            acquired.set()
+
+        thread = threading.Thread(target=acquire)
+        thread.start()
+        self.assertFalse(acquired.wait(0.05))
+        budget.release(80)
+        self.assertTrue(acquired.wait(5))
+        thread.join()
+        self.assertEqual(budget.in_use, 50)
+
+    def test_oversized_file_is_admitted_alone(self):
+        budget = MemoryBudget(100)
+        budget.acquire(1000)
+        self.assertEqual(budget.in_use, 1000)
+
+
+class TestStats(unittest.TestCase):
+    def test_stage_utilization(self):
+        stats = StageStats(workers=2)
+        stats.add(1.0)
+        stats.add(2.0)
+        self.assertEqual(stats.items, 2)
+        self.assertAlmostEqual(stats.utilization(3.0), 0.5)
+
+    def test_queue_depth(self):
+        stats = QueueStats(capacity=4)
+        for depth in (0, 4, 2):
+            stats.sample(depth)
+        self.assertEqual(stats.max, 4)
+        self.assertAlmostEqual(stats.mean, 2.0)
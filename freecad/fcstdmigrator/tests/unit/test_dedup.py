@@ -0,0 +1,147 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+
+import io
+import unittest
+import zipfile
+from unittest import mock
+
+from freecad.fcstdmigrator import dedup
+from freecad.fcstdmigrator.dedup import MemberCache, _Entry, copy_member
+
+
+def _archive(members, compression=zipfile.ZIP_DEFLATED) -> zipfile.ZipFile:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", compression) as z:
+        for name, data in members.items():
+            z.writestr(name, data)
+    return zipfile.ZipFile(buffer, "r")
+
+
+class _Unseekable(io.RawIOBase):
+    """A write-only stream that cannot seek, like an upload."""
+
+    def __init__(self):
+        super().__init__()
+        self.buffer = io.BytesIO()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        return self.buffer.write(data)
+
+    def tell(self):
+        return self.buffer.tell()
+
+
+def _copy_all(cache, source, seekable=True) -> zipfile.ZipFile:
+    stream = io.BytesIO() if seekable else _Unseekable()
+    with zipfile.ZipFile(stream, "w") as output:
+        output.writestr("Document.xml", "<Document/>")
+        for info in source.infolist():
+            cache.copy(source, info, [output])
+    if not seekable:
+        stream = stream.buffer
+    return zipfile.ZipFile(stream, "r")
+
+
+class TestMemberCache(unittest.TestCase):
+    def test_duplicates_are_reused(self):
+        shape = b"BREP shape " * 1000
+        cache = MemberCache(1024 * 1024)
+        first = _copy_all(cache, _archive({"Shape.brp": shape, "Thumb.png": b"a"}))
+        second = _copy_all(cache, _archive({"Other.brp": shape, "Thumb.png": b"b"}))
+
+        for output in (first, second):
+            self.assertIsNone(output.testzip())
+            self.assertEqual(output.read("Document.xml"), b"<Document/>")
+        self.assertEqual(second.read("Other.brp"), shape)
+        self.assertEqual(second.read("Thumb.png"), b"b")
+        self.assertEqual(second.getinfo("Other.brp").compress_type, zipfile.ZIP_DEFLATED)
+        self.assertLess(second.getinfo("Other.brp").compress_size, len(shape))
+        self.assertEqual(cache.stats.members, 4)
+        self.assertEqual(cache.stats.duplicates, 1)
+        self.assertEqual(cache.stats.duplicate_bytes, len(shape))
+        self.assertAlmostEqual(cache.stats.ratio, (2 * len(shape) + 2) / (len(shape) + 2))
+
+    def test_non_seekable_output(self):
+        shape = b"BREP shape " * 1000
+        cache = MemberCache(1024 * 1024)
+        for _ in range(2):
+            output = _copy_all(cache, _archive({"Shape.brp": shape}), seekable=False)
+            self.assertIsNone(output.testzip())
+            self.assertEqual(output.read("Shape.brp"), shape)
+        self.assertEqual(cache.stats.duplicates, 1)
+
+    def test_falls_back_to_writestr(self):
+        shape = b"BREP shape " * 1000
+        cache = MemberCache(1024 * 1024)
+        with mock.patch.object(dedup, "RAW_WRITES", False):
+            for seekable in (True, False):
+                output = _copy_all(cache, _archive({"Shape.brp": shape}), seekable)
+                self.assertIsNone(output.testzip())
+                self.assertEqual(output.read("Shape.brp"), shape)
+                self.assertEqual(output.getinfo("Shape.brp").compress_type, zipfile.ZIP_DEFLATED)
+
+    def test_refuses_to_write_while_a_member_is_open(self):
+        cache = MemberCache(1024 * 1024)
+        source = _archive({"Shape.brp": b"shape"})
+        with zipfile.ZipFile(io.BytesIO(), "w") as output:
+            with output.open("Open.txt", "w"):
+                with self.assertRaises(ValueError):
+                    cache.copy(source, source.getinfo("Shape.brp"), [output])
+
+    def test_stored_members_stay_stored(self):
+        cache = MemberCache(1024 * 1024)
+        output = _copy_all(cache, _archive({"Thumb.png": b"png" * 100}, zipfile.ZIP_STORED))
+        self.assertEqual(output.getinfo("Thumb.png").compress_type, zipfile.ZIP_STORED)
+        self.assertEqual(output.read("Thumb.png"), b"png" * 100)
+
+    def test_compressed_bytes_are_copied_as_they_are(self):
+        shape = b"BREP shape " * 1000
+        source = _archive({"Shape.brp": shape})
+        info = source.getinfo("Shape.brp")
+        with mock.patch.object(source, "read", side_effect=AssertionError("decompressed")):
+            output = _copy_all(MemberCache(1024 * 1024), source)
+        self.assertEqual(output.read("Shape.brp"), shape)
+        self.assertEqual(output.getinfo("Shape.brp").compress_type, zipfile.ZIP_DEFLATED)
+        self.assertEqual(output.getinfo("Shape.brp").compress_size, info.compress_size)
+
+    def test_same_crc_and_size_with_different_contents(self):
+        cache = MemberCache(1024 * 1024)
+        source = _archive({"Shape.brp": b"shape"})
+        info = source.getinfo("Shape.brp")
+        cache._add((info.CRC, info.file_size), _Entry(zipfile.ZIP_STORED, b"other"))
+
+        output = _copy_all(cache, source)
+        self.assertEqual(output.read("Shape.brp"), b"shape")
+        self.assertEqual(cache.stats.duplicates, 0)
+
+    def test_least_recently_used_members_are_evicted(self):
+        cache = MemberCache(250)
+        for index in range(5):
+            _copy_all(cache, _archive({"Data": bytes([index]) * 100}, zipfile.ZIP_STORED))
+        self.assertEqual(cache.size, 200)
+        _copy_all(cache, _archive({"Data": bytes([4]) * 100}, zipfile.ZIP_STORED))
+        _copy_all(cache, _archive({"Data": bytes([0]) * 100}, zipfile.ZIP_STORED))
+        self.assertEqual(cache.stats.duplicates, 1)
+
+
+class TestCopyMember(unittest.TestCase):
+    def test_compression_is_kept(self):
+        source = _archive({"Shape.brp": b"shape" * 100})
+        stored = _archive({"Thumb.png": b"png" * 100}, zipfile.ZIP_STORED)
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w") as output:
+            for archive in (source, stored):
+                for info in archive.infolist():
+                    copy_member(archive, info, [output])
+        with zipfile.ZipFile(buffer, "r") as output:
+            self.assertIsNone(output.testzip())
+            self.assertEqual(output.getinfo("Shape.brp").compress_type, zipfile.ZIP_DEFLATED)
+            self.assertEqual(output.getinfo("Thumb.png").compress_type, zipfile.ZIP_STORED)
+            self.assertEqual(output.read("Shape.brp"), b"shape" * 100)
+
+
+if __name__ == "__main__":
+    unittest.main()
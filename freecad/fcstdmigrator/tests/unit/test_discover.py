@@ -1,5 +1,6 @@
 # SPDX-License-Identifier: LGPL-2.1-or-later
 
+import pickle
 import sys
 import tempfile
 from unittest import TestCase, mock
@@ -110,3 +111,27 @@ class FallbackMigrator(Migrator): pass
 
         names = {cls.__name__ for cls in result}
         self.assertIn("FallbackMigrator", names)
+
+    def test_repeated_discovery_reuses_modules(self):
+        pkg_dir = self.tmp_path / "mypkg"
+        pkg_dir.mkdir()
+        (pkg_dir / "my_migrator.py").write_text(
+            """
+from fake_migrator_base import Migrator
+class MyMigrator(Migrator):
+    pass
+"""
+        )
+        from fake_migrator_base import Migrator as FakeMigrator
+
+        with mock.patch.object(discover, "Migrator", FakeMigrator):
+            first = discover.find_migrator_subclasses(str(pkg_dir))
+            path_length = len(sys.path)
+            second = discover.find_migrator_subclasses(str(pkg_dir))
+
+        self.addCleanup(sys.modules.pop, "mypkg.my_migrator", None)
+        self.addCleanup(sys.modules.pop, "mypkg", None)
+        self.assertEqual(len(sys.path), path_length)
+        self.assertEqual(len(first), 1)
+        self.assertIs(first[0], second[0])
+        self.assertIs(pickle.loads(pickle.dumps(first[0])), first[0])
@@ -0,0 +1,79 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+
+import unittest
+from xml.etree.ElementTree import Element, SubElement, fromstring, tostring
+
+from freecad.fcstdmigrator import journal
+from freecad.fcstdmigrator.journal import Journal
+from freecad.fcstdmigrator.migrator import Migrator
+
+
+def _tree():
+    return fromstring(
+        '<Document a="1"><Properties><Property name="Length" type="Float">2.5</Property>'
+        "</Properties><ObjectData/></Document>"
+    )
+
+
+class TestJournal(unittest.TestCase):
+    def test_rollback_restores_recorded_edits(self):
+        root = _tree()
+        original = tostring(root)
+        prop = root.find("Properties/Property")
+        with Journal() as changes:
+            journal.set_attribute(root, "a", "2")
+            journal.set_attribute(root, "b", "new")
+            journal.set_text(prop, "3.5")
+            journal.append_child(root.find("ObjectData"), Element("Object"))
+            journal.remove_child(root, root.find("Properties"))
+        self.assertNotEqual(tostring(root), original)
+
+        changes.rollback()
+        self.assertEqual(tostring(root), original)
+        self.assertIs(root.find("Properties/Property"), prop)
+
+    def test_only_first_change_is_recorded(self):
+        root = _tree()
+        with Journal() as changes:
+            for value in range(10):
+                journal.set_attribute(root, "a", str(value))
+        self.assertEqual(len(changes), 1)
+        changes.rollback()
+        self.assertEqual(root.get("a"), "1")
+
+    def test_edits_outside_a_journal_are_not_recorded(self):
+        changes = Journal()
+        root = _tree()
+        journal.set_attribute(root, "a", "2")
+        self.assertEqual(len(changes), 0)
+
+    def test_subtree_rollback_keeps_earlier_records_valid(self):
+        root = _tree()
+        original = tostring(root)
+        with Journal() as changes:
+            Migrator.rename_property(root, "Length", "Size")
+
+            def rebuild(prop):
+                prop.text = None
+                SubElement(prop, "Float", value="3.5")
+
+            Migrator.change_property_type(root, "Size", "App::PropertyLength", rebuild)
+            Migrator.transform_property(root, "Size", lambda prop: prop.clear())
+        changes.rollback()
+        self.assertEqual(tostring(root), original)
+
+    def test_nested_journals(self):
+        root = _tree()
+        with Journal() as outer:
+            journal.set_attribute(root, "a", "2")
+            with Journal() as inner:
+                journal.set_attribute(root, "a", "3")
+            inner.rollback()
+            self.assertEqual(root.get("a"), "2")
+            journal.set_attribute(root, "a", "4")
+        outer.rollback()
+        self.assertEqual(root.get("a"), "1")
+
+
+if __name__ == "__main__":
+    unittest.main()
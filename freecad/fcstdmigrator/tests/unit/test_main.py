@@ -1,5 +1,7 @@
 # SPDX-License-Identifier: LGPL-2.1-or-later
 
+import argparse
+import tempfile
 from unittest import TestCase
 from unittest.mock import patch
 import pathlib
@@ -91,3 +93,126 @@ class TestMain(TestCase):
             self.assertEqual(args.input, self.test_input)
             self.assertEqual(args.output, self.test_output)
             self.assertEqual(args.version, self.test_version)
+
+    @patch("pathlib.Path.is_dir")
+    @patch("pathlib.Path.is_file")
+    def test_parse_args_verify_does_not_require_output(self, mock_is_file, mock_is_dir):
+        mock_is_file.return_value = False
+        mock_is_dir.return_value = True
+        test_args = ["prog", "-i", "corpus", "-v", self.test_version, "--verify", "-j", "4"]
+        with patch("sys.argv", test_args):
+            args = main.parse_args()
+            self.assertTrue(args.verify)
+            self.assertIsNone(args.output)
+            self.assertEqual(args.jobs, 4)
+
+    @patch("pathlib.Path.is_file")
+    def test_parse_args_probe_does_not_require_output(self, mock_is_file):
+        mock_is_file.return_value = True
+        test_args = ["prog", "-i", str(self.test_input), "-v", self.test_version, "--probe"]
+        with patch("sys.argv", test_args):
+            args = main.parse_args()
+            self.assertTrue(args.probe)
+            self.assertIsNone(args.output)
+
+    @patch("pathlib.Path.is_file")
+    def test_parse_args_output_required_without_verify(self, mock_is_file):
+        mock_is_file.return_value = True
+        test_args = ["prog", "-i", str(self.test_input), "-v", self.test_version]
+        with patch("sys.argv", test_args), patch("sys.stderr"):
+            with self.assertRaises(SystemExit):
+                main.parse_args()
+
+    @patch("pathlib.Path.is_file")
+    @patch("pathlib.Path.exists")
+    def test_parse_args_also_export(self, mock_exists, mock_is_file):
+        mock_is_file.return_value = True
+        mock_exists.return_value = False
+        test_args = [
+            "prog",
+            "-i",
+            str(self.test_input),
+            "-o",
+            str(self.test_output),
+            "-v",
+            "1.1",
+            "-a",
+            "1.0",
+            "output_1.0.FCStd",
+            "--also-export",
+            "0.21",
+            "output_0.21.FCStd",
+        ]
+        with patch("sys.argv", test_args):
+            args = main.parse_args()
+            self.assertEqual(
+                args.also_export, [["1.0", "output_1.0.FCStd"], ["0.21", "output_0.21.FCStd"]]
+            )
+
+    @patch("pathlib.Path.is_file")
+    @patch("pathlib.Path.exists")
+    def test_parse_args_also_export_duplicate_version(self, mock_exists, mock_is_file):
+        mock_is_file.return_value = True
+        mock_exists.return_value = False
+        test_args = [
+            "prog",
+            "-i",
+            str(self.test_input),
+            "-o",
+            str(self.test_output),
+            "-v",
+            "1.1",
+            "-a",
+            "1.1.0",
+            "output_1.1.FCStd",
+        ]
+        with patch("sys.argv", test_args), patch("sys.stderr"):
+            with self.assertRaises(SystemExit):
+                main.parse_args()
+
+    @patch("pathlib.Path.is_dir")
+    @patch("pathlib.Path.is_file")
+    @patch("pathlib.Path.exists")
+    def test_parse_args_directory_input(self, mock_exists, mock_is_file, mock_is_dir):
+        mock_is_dir.return_value = True
+        mock_is_file.return_value = False
+        mock_exists.return_value = False
+        test_args = ["prog", "-i", "corpus", "-o", "migrated", "-v", "1.1", "--queue-depth", "8"]
+        with patch("sys.argv", test_args):
+            args = main.parse_args()
+            self.assertEqual(args.output, pathlib.Path("migrated"))
+            self.assertEqual(args.queue_depth, 8)
+            self.assertEqual(args.readers, 2)
+
+    @patch("pathlib.Path.is_dir")
+    @patch("pathlib.Path.is_file")
+    @patch("pathlib.Path.exists")
+    def test_parse_args_shard(self, mock_exists, mock_is_file, mock_is_dir):
+        mock_is_dir.return_value = True
+        mock_is_file.return_value = False
+        mock_exists.return_value = False
+        test_args = ["prog", "-i", "corpus", "-o", "out", "-v", "1.1", "--shard", "2/3"]
+        with patch("sys.argv", test_args):
+            args = main.parse_args()
+            self.assertEqual(args.shard, (2, 3))
+            self.assertEqual(args.shard_by, "path")
+        with patch("sys.argv", test_args[:-1] + ["4/3"]), patch("sys.stderr"):
+            with self.assertRaises(SystemExit):
+                main.parse_args()
+
+    def test_parse_args_merge_manifests_needs_no_input(self):
+        test_args = ["prog", "--merge-manifests", "shard1.json", "shard2.json"]
+        with patch("sys.argv", test_args):
+            args = main.parse_args()
+            self.assertEqual(
+                args.merge_manifests, [pathlib.Path("shard1.json"), pathlib.Path("shard2.json")]
+            )
+
+    def test_input_files_of_a_directory(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            root = pathlib.Path(tmpdir)
+            (root / "sub").mkdir()
+            for name in ("b.FCStd", "sub/a.fcstd", "notes.txt"):
+                (root / name).write_bytes(b"")
+            files = main.input_files(argparse.Namespace(input=root))
+        self.assertEqual(files, [str(root / "b.FCStd"), str(root / "sub" / "a.fcstd")])
@@ -1,14 +1,55 @@
 # SPDX-License-Identifier: LGPL-2.1-or-later
 
+import sys
 import unittest
 from unittest import mock
 import tempfile
 import zipfile
 import pathlib
-from xml.etree.ElementTree import Element, fromstring
+from datetime import date
+from xml.etree.ElementTree import Element, fromstring, tostring
 from packaging.version import Version
 
+from freecad.fcstdmigrator import migrate
+from freecad.fcstdmigrator.discover import find_migrator_subclasses
 from freecad.fcstdmigrator.migrate import Migrate
+from freecad.fcstdmigrator.migrator import IncompatibleVersionException, Migrator
+from freecad.fcstdmigrator.migrations.freecad_1_1.arch_draft_color_transparency_to_alpha import (
+    ArchDraftColorTransparencyToAlpha,
+)
+
+
+class RenameLengthToSize(Migrator):
+    name = "Rename Length to Size"
+    description = "Object-local test migrator"
+    changed_in_freecad_version = Version("1.1")
+    changed_on_date = date(2025, 1, 1)
+    changed_in_hash = "abc"
+    object_local = True
+
+    def forward(self, document_xml, gui_document_xml):
+        Migrator.rename_property(document_xml, "Length", "Size")
+        Migrator.rename_property(gui_document_xml, "Visibility", "Visible")
+
+    def backward(self, document_xml, gui_document_xml):
+        Migrator.rename_property(document_xml, "Size", "Length")
+        Migrator.rename_property(gui_document_xml, "Visible", "Visibility")
+
+
+class RefuseDowngrade(Migrator):
+    name = "Refuse downgrade"
+    description = "Test migrator that fails partway through its backward migration"
+    changed_in_freecad_version = Version("1.1")
+    changed_on_date = date(2024, 1, 1)
+    changed_in_hash = "def"
+    object_local = True
+
+    def forward(self, document_xml, gui_document_xml):
+        pass
+
+    def backward(self, document_xml, gui_document_xml):
+        Migrator.set_attribute(document_xml, "Refused", "yes")
+        raise IncompatibleVersionException("uses a feature that 1.0 does not have")
 
 
 class TestExtractVersion(unittest.TestCase):
@@ -76,15 +117,17 @@ class TestMigrationLogic(unittest.TestCase):
         cls = mock.Mock()
         cls.name = name
         cls.changed_in_freecad_version = Version(version)
-        cls.date = version
+        cls.changed_on_date = Version(version)
         cls.return_value.forward = mock.Mock()
         cls.return_value.backward = mock.Mock()
+        cls.return_value.forward_members.return_value = {}
+        cls.return_value.backward_members.return_value = {}
         return cls
 
     @mock.patch("freecad.fcstdmigrator.migrate.find_migrator_subclasses")
     def test_runs_forward_or_backward_correctly(self, mock_find):
         forward = self.make_mock_migrator("Forward", "2.0")
-        backward = self.make_mock_migrator("Backward", "0.5")
+        backward = self.make_mock_migrator("Backward", "0.8")
         mock_find.return_value = [forward, backward]
 
         # Target higher than original -> forward migration
@@ -99,6 +142,129 @@ class TestMigrationLogic(unittest.TestCase):
         backward.return_value.backward.assert_called()
         forward.return_value.forward.assert_not_called()
 
+    @mock.patch("freecad.fcstdmigrator.migrate.find_migrator_subclasses")
+    def test_only_runs_migrators_between_versions(self, mock_find):
+        older = self.make_mock_migrator("Older", "0.8")
+        newer = self.make_mock_migrator("Newer", "1.1")
+        newest = self.make_mock_migrator("Newest", "2.0")
+        mock_find.return_value = [newest, older, newer]
+
+        m = Migrate(str(self.freecad_file), Version("1.1"))
+        newer.return_value.forward.assert_called_once()
+        newest.return_value.forward.assert_not_called()
+        older.return_value.forward.assert_not_called()
+        self.assertEqual(m.current_version, Version("1.1"))
+
+        # Migrating back to the original version undoes exactly the same migrators
+        m.migrate_to(m.original_version)
+        newer.return_value.backward.assert_called_once()
+        newest.return_value.backward.assert_not_called()
+        older.return_value.backward.assert_not_called()
+        self.assertEqual(m.current_version, Version("1.0"))
+
+
+class TestParallelMigration(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.freecad_file = pathlib.Path(self.tmpdir.name) / "large.FCStd"
+        objects = "".join(
+            f'<Object name="Box{i}"><Properties><Property name="Length"/></Properties></Object>'
+            for i in range(25)
+        )
+        view_providers = "".join(
+            f'<ViewProvider name="Box{i}"><Properties><Property name="Visibility"/></Properties>'
+            "</ViewProvider>"
+            for i in range(25)
+        )
+        with zipfile.ZipFile(self.freecad_file, "w") as z:
+            z.writestr(
+                "Document.xml",
+                '<Document ProgramVersion="1.0"><Properties><Property name="Length"/></Properties>'
+                f'<ObjectData Count="25">{objects}</ObjectData></Document>',
+            )
+            z.writestr(
+                "GuiDocument.xml",
+                f"<GuiDocument><ViewProviderData>{view_providers}</ViewProviderData></GuiDocument>",
+            )
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    @mock.patch.object(migrate, "MIN_OBJECTS_PER_CHUNK", 5)
+    @mock.patch("freecad.fcstdmigrator.migrate.find_migrator_subclasses")
+    def test_parallel_result_matches_serial(self, mock_find):
+        mock_find.return_value = [RenameLengthToSize]
+        serial = Migrate(str(self.freecad_file), Version("1.1"))
+        parallel = Migrate(str(self.freecad_file), Version("1.1"), jobs=3)
+
+        self.assertEqual(tostring(serial.document_xml), tostring(parallel.document_xml))
+        self.assertEqual(tostring(serial.gui_document_xml), tostring(parallel.gui_document_xml))
+        names = [obj.get("name") for obj in parallel.document_xml.find("ObjectData")]
+        self.assertEqual(names, [f"Box{i}" for i in range(25)])
+        self.assertEqual(len(list(parallel.document_xml.iter("Property"))), 26)
+        self.assertTrue(
+            all(p.get("name") == "Size" for p in parallel.document_xml.iter("Property"))
+        )
+
+        parallel.migrate_to(Version("1.0"))
+        self.assertTrue(
+            all(p.get("name") == "Length" for p in parallel.document_xml.iter("Property"))
+        )
+
+    @mock.patch.object(migrate, "MIN_OBJECTS_PER_CHUNK", 5)
+    @mock.patch("freecad.fcstdmigrator.migrate.find_migrator_subclasses")
+    def test_failed_migration_is_rolled_back(self, mock_find):
+        mock_find.return_value = [RenameLengthToSize, RefuseDowngrade]
+        for jobs in (1, 3):
+            m = Migrate(str(self.freecad_file), Version("1.1"), jobs=jobs)
+            document, gui_document = tostring(m.document_xml), tostring(m.gui_document_xml)
+
+            with self.assertRaises(IncompatibleVersionException):
+                m.migrate_to(Version("1.0"))
+            self.assertEqual(tostring(m.document_xml), document)
+            self.assertEqual(tostring(m.gui_document_xml), gui_document)
+            self.assertEqual(m.current_version, Version("1.1"))
+
+            self.assertEqual(
+                m.migrate_to_first_compatible([Version("1.0"), Version("1.1")]), Version("1.1")
+            )
+            self.assertEqual(tostring(m.document_xml), document)
+
+    @mock.patch.object(migrate, "MIN_OBJECTS_PER_CHUNK", 5)
+    def test_second_instance_keeps_migrators_picklable(self):
+        migrations = pathlib.Path(self.tmpdir.name) / "two_instance_migrations"
+        migrations.mkdir()
+        (migrations / "rename.py").write_text(
+            "from datetime import date\n"
+            "from packaging.version import Version\n"
+            "from freecad.fcstdmigrator.migrator import Migrator\n"
+            "class Rename(Migrator):\n"
+            "    name = description = changed_in_hash = 'rename'\n"
+            "    changed_in_freecad_version = Version('1.1')\n"
+            "    changed_on_date = date(2025, 1, 1)\n"
+            "    object_local = True\n"
+            "    def forward(self, document_xml, gui_document_xml):\n"
+            "        Migrator.rename_property(document_xml, 'Length', 'Size')\n"
+            "    def backward(self, document_xml, gui_document_xml):\n"
+            "        Migrator.rename_property(document_xml, 'Size', 'Length')\n"
+        )
+        self.addCleanup(sys.path.remove, str(migrations.parent))
+        self.addCleanup(sys.modules.pop, "two_instance_migrations.rename", None)
+        self.addCleanup(sys.modules.pop, "two_instance_migrations", None)
+
+        def find(root):
+            return find_migrator_subclasses(str(migrations))
+
+        with mock.patch.object(migrate, "find_migrator_subclasses", side_effect=find):
+            first = Migrate(str(self.freecad_file), Version("1.1"), jobs=3)
+            Migrate(str(self.freecad_file), Version("1.1"), jobs=3)
+            first.migrate_to(Version("1.0"))
+
+        self.assertTrue(all(p.get("name") == "Length" for p in first.document_xml.iter("Property")))
+
+    def test_split_preserves_order(self):
+        self.assertEqual(migrate._split(list(range(7)), 3), [[0, 1, 2], [3, 4], [5, 6]])
+
 
 class TestExport(unittest.TestCase):
     def setUp(self):
@@ -121,6 +287,9 @@ class TestExport(unittest.TestCase):
         m.target_version = Version("2.0")
         m.document_xml = Element("Document", ProgramVersion="1.0")
         m.gui_document_xml = Element("GuiDocument", ProgramVersion="1.0")
+        m.member_transforms = []
+        m.source_version = Version("1.0")
+        m.applied = []
 
         m.export(str(self.out_file))
 
@@ -130,3 +299,74 @@ class TestExport(unittest.TestCase):
             self.assertIn("GuiDocument.xml", files)
             doc = fromstring(z.read("Document.xml"))
             self.assertEqual(doc.attrib["ProgramVersion"], "2.0")
+
+    @mock.patch("freecad.fcstdmigrator.migrate.find_migrator_subclasses")
+    def test_export_versions_parses_once(self, mock_find):
+        mock_find.return_value = [RenameLengthToSize]
+        with zipfile.ZipFile(self.freecad_file, "w") as z:
+            z.writestr(
+                "Document.xml",
+                '<Document ProgramVersion="1.0"><Property name="Length"/></Document>',
+            )
+            z.writestr("GuiDocument.xml", '<GuiDocument ProgramVersion="1.0"/>')
+            z.writestr("Extra.dat", b"extra")
+        outputs = {
+            Version("0.21"): str(pathlib.Path(self.tmpdir.name) / "0.21.FCStd"),
+            Version("1.0"): str(pathlib.Path(self.tmpdir.name) / "1.0.FCStd"),
+            Version("1.1"): str(pathlib.Path(self.tmpdir.name) / "1.1.FCStd"),
+        }
+
+        m = Migrate(str(self.freecad_file), None)
+        with mock.patch.object(m, "load_xml") as load_xml:
+            m.export_versions(outputs)
+            load_xml.assert_not_called()
+
+        expected_names = {"0.21": "Length", "1.0": "Length", "1.1": "Size"}
+        for version, filename in outputs.items():
+            with zipfile.ZipFile(filename, "r") as z:
+                self.assertEqual(z.read("Extra.dat"), b"extra")
+                self.assertEqual(len(z.namelist()), 4)
+                doc = fromstring(z.read("Document.xml"))
+                gui = fromstring(z.read("GuiDocument.xml"))
+            self.assertEqual(doc.attrib["ProgramVersion"], str(version))
+            self.assertEqual(gui.attrib["ProgramVersion"], str(version))
+            self.assertEqual(doc.find("Property").get("name"), expected_names[str(version)])
+
+    @mock.patch("freecad.fcstdmigrator.migrate.find_migrator_subclasses")
+    def test_color_list_members_are_transformed(self, mock_find):
+        mock_find.return_value = [ArchDraftColorTransparencyToAlpha]
+        colors = [0xFF000000, 0x00FF0040, 0x0000FFFF]
+        color_list = len(colors).to_bytes(4, "little") + b"".join(
+            color.to_bytes(4, "little") for color in colors
+        )
+        with zipfile.ZipFile(self.freecad_file, "w") as z:
+            z.writestr("Document.xml", '<Document ProgramVersion="1.0"/>')
+            z.writestr(
+                "GuiDocument.xml",
+                '<GuiDocument ProgramVersion="1.0"><ViewProviderData>'
+                '<ViewProvider name="Wall"><Properties>'
+                '<Property name="DiffuseColor" type="App::PropertyColorList">'
+                '<ColorList file="DiffuseColor"/></Property>'
+                "</Properties></ViewProvider></ViewProviderData></GuiDocument>",
+            )
+            z.writestr("DiffuseColor", color_list)
+
+        m = Migrate(str(self.freecad_file), Version("1.1"))
+        m.export(str(self.out_file))
+        with zipfile.ZipFile(self.out_file, "r") as z:
+            migrated = z.read("DiffuseColor")
+        alphas = [0xFF, 0xBF, 0x00]
+        expected = len(colors).to_bytes(4, "little") + b"".join(
+            (color & ~0xFF | alpha).to_bytes(4, "little") for color, alpha in zip(colors, alphas)
+        )
+        self.assertEqual(migrated, expected)
+
+        outputs = {
+            Version("1.0"): str(pathlib.Path(self.tmpdir.name) / "1.0.FCStd"),
+            Version("1.1"): str(pathlib.Path(self.tmpdir.name) / "1.1.FCStd"),
+        }
+        Migrate(str(self.freecad_file), None).export_versions(outputs)
+        with zipfile.ZipFile(outputs[Version("1.0")], "r") as z:
+            self.assertEqual(z.read("DiffuseColor"), color_list)
+        with zipfile.ZipFile(outputs[Version("1.1")], "r") as z:
+            self.assertEqual(z.read("DiffuseColor"), expected)
@@ -0,0 +1,131 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+
+import unittest
+from unittest import mock
+import tempfile
+import zipfile
+import pathlib
+from datetime import date
+from packaging.version import Version
+
+from in_process import executor_in_process
+
+from freecad.fcstdmigrator.migrator import IncompatibleVersionException, Migrator
+from freecad.fcstdmigrator.probe import probe_corpus, probe_downgrade
+from freecad.fcstdmigrator.xml_utilities import find_objects_with_property_type
+
+DOCUMENT_XML = """<Document ProgramVersion="1.1">
+    <ObjectData Count="2">
+        <Object name="Box">
+            <Properties Count="1">
+                <Property name="Shape" type="Part::PropertyPartShape"/>
+            </Properties>
+        </Object>
+        <Object name="Sketch">
+            <Properties Count="1">
+                <Property name="Constraints" type="Sketcher::PropertyConstraintList"/>
+            </Properties>
+        </Object>
+    </ObjectData>
+</Document>"""
+
+
+class NewConstraints(Migrator):
+    name = "New constraints"
+    description = "Test migrator that cannot downgrade documents with constraints"
+    changed_in_freecad_version = Version("1.1")
+    changed_on_date = date(2025, 1, 1)
+    changed_in_hash = "abc"
+
+    def forward(self, document_xml, gui_document_xml):
+        pass
+
+    def backward(self, document_xml, gui_document_xml):
+        if self.check_backward(document_xml, gui_document_xml):
+            raise IncompatibleVersionException("constraints cannot be downgraded")
+
+    def check_backward(self, document_xml, gui_document_xml):
+        return find_objects_with_property_type(document_xml, "Sketcher::PropertyConstraintList")
+
+
+class RenameShape(Migrator):
+    name = "Rename shape"
+    description = "Test migrator that never blocks a downgrade"
+    changed_in_freecad_version = Version("1.0")
+    changed_on_date = date(2024, 1, 1)
+    changed_in_hash = "def"
+
+    def forward(self, document_xml, gui_document_xml):
+        Migrator.rename_property(document_xml, "OldShape", "Shape")
+
+    def backward(self, document_xml, gui_document_xml):
+        Migrator.rename_property(document_xml, "Shape", "OldShape")
+
+
+class TestProbe(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.freecad_file = pathlib.Path(self.tmpdir.name) / "test.FCStd"
+        self.write(self.freecad_file, DOCUMENT_XML)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    @staticmethod
+    def write(path, document_xml):
+        with zipfile.ZipFile(path, "w") as z:
+            z.writestr("Document.xml", document_xml)
+            z.writestr("GuiDocument.xml", '<GuiDocument ProgramVersion="1.1"/>')
+
+    @mock.patch("freecad.fcstdmigrator.migrate.find_migrator_subclasses")
+    def test_blocked_downgrade(self, mock_find):
+        mock_find.return_value = [RenameShape, NewConstraints]
+        result = probe_downgrade(str(self.freecad_file), Version("0.21"))
+        self.assertFalse(result.ok)
+        self.assertEqual(result.original_version, Version("1.1"))
+        self.assertEqual(result.reachable_version, Version("1.1"))
+        self.assertEqual([blocker.reason for blocker in result.blockers], ["Sketch"])
+        self.assertEqual(result.blockers[0].migrator, "New constraints")
+
+    @mock.patch("freecad.fcstdmigrator.migrate.find_migrator_subclasses")
+    def test_unblocked_downgrade(self, mock_find):
+        mock_find.return_value = [RenameShape, NewConstraints]
+        self.write(self.freecad_file, DOCUMENT_XML.replace("Sketcher::", "App::"))
+        result = probe_downgrade(str(self.freecad_file), Version("0.21"))
+        self.assertTrue(result.ok)
+        self.assertEqual(result.blockers, [])
+
+    @mock.patch("freecad.fcstdmigrator.migrate.find_migrator_subclasses")
+    def test_probe_does_not_run_migrations(self, mock_find):
+        mock_find.return_value = [RenameShape, NewConstraints]
+        with mock.patch.object(RenameShape, "backward") as backward:
+            probe_downgrade(str(self.freecad_file), Version("0.21"))
+            backward.assert_not_called()
+
+    @mock.patch("freecad.fcstdmigrator.migrate.find_migrator_subclasses")
+    def test_given_migrators_are_not_discovered(self, mock_find):
+        result = probe_downgrade(
+            str(self.freecad_file), Version("0.21"), [RenameShape, NewConstraints]
+        )
+        self.assertEqual(result.reachable_version, Version("1.1"))
+        mock_find.assert_not_called()
+
+    def test_gui_document_is_only_parsed_if_a_migrator_is_checked(self):
+        with zipfile.ZipFile(self.freecad_file, "w") as z:
+            z.writestr("Document.xml", DOCUMENT_XML)
+        self.assertTrue(probe_downgrade(str(self.freecad_file), Version("0.21"), []).ok)
+        with self.assertRaises(FileNotFoundError):
+            probe_downgrade(str(self.freecad_file), Version("0.21"), [NewConstraints])
+
+    @mock.patch("freecad.fcstdmigrator.migrate.find_migrator_subclasses")
+    def test_probe_corpus_reports_errors_per_file(self, mock_find):
+        mock_find.return_value = [RenameShape, NewConstraints]
+        missing = str(pathlib.Path(self.tmpdir.name) / "missing.FCStd")
+        with executor_in_process("freecad.fcstdmigrator.probe"):
+            results = probe_corpus([str(self.freecad_file), missing], Version("1.0"))
+        self.assertEqual(results[0].reachable_version, Version("1.1"))
+        self.assertIsNotNone(results[1].error)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+
+import os
+import tempfile
+import time
+import unittest
+from collections import Counter
+
+from freecad.fcstdmigrator import profiling
+from freecad.fcstdmigrator.profiling import SamplingProfiler, merge, stage, stage_table
+
+
+def _busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+class TestSamplingProfiler(unittest.TestCase):
+    def test_stages_nest_and_unwind(self):
+        with stage("migrate"):
+            with stage("migrator:Example"):
+                self.assertEqual(
+                    list(profiling._stages.values()), [["migrate", "migrator:Example"]]
+                )
+        self.assertEqual(profiling._stages, {})
+
+    def test_only_samples_inside_stages(self):
+        with SamplingProfiler(interval=0.001) as profiler:
+            _busy(0.05)
+            with stage("parse"):
+                _busy(0.1)
+        self.assertGreater(sum(profiler.samples.values()), 0)
+        for stack in profiler.samples:
+            self.assertTrue(stack.startswith("[parse];"))
+            self.assertIn("_busy (test_profiling.py:", stack)
+
+    def test_merge(self):
+        merged = merge([Counter({"[a];f": 2}), Counter({"[a];f": 1, "[b];g": 4})])
+        self.assertEqual(merged, Counter({"[a];f": 3, "[b];g": 4}))
+
+    def test_stage_table_groups_nested_stages(self):
+        samples = Counter(
+            {
+                "[migrate];[migrator:A];f;g": 6,
+                "[migrate];[migrator:A];f;h": 2,
+                "[read];read": 2,
+            }
+        )
+        lines = stage_table(samples).splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[1].endswith("80.0  migrate > migrator:A"))
+        self.assertTrue(lines[2].endswith("20.0  read"))
+
+    def test_write_collapsed(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "profile.txt")
+            profiling.write_collapsed(Counter({"[b];g": 4, "[a];f": 3}), filename)
+            with open(filename, encoding="utf-8") as f:
+                self.assertEqual(f.read(), "[a];f 3\n[b];g 4\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,140 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+
+import json
+import unittest
+from unittest import mock
+import tempfile
+import zipfile
+import pathlib
+from datetime import date
+from packaging.version import Version
+
+from freecad.fcstdmigrator.migrate import Migrate
+from freecad.fcstdmigrator.migrator import Migrator
+from freecad.fcstdmigrator.provenance import (
+    PROVENANCE_MEMBER,
+    is_up_to_date,
+    missing_migrators,
+    read_provenance,
+)
+
+
+class CountingMigrator(Migrator):
+    name = "Rename Length to Size"
+    description = "Test migrator that counts how often it runs"
+    changed_in_freecad_version = Version("1.1")
+    changed_on_date = date(2025, 1, 1)
+    changed_in_hash = "abc"
+    runs = []
+
+    def forward(self, document_xml, gui_document_xml):
+        self.runs.append((self.name, "forward"))
+        Migrator.rename_property(document_xml, "Length", "Size")
+
+    def backward(self, document_xml, gui_document_xml):
+        self.runs.append((self.name, "backward"))
+        Migrator.rename_property(document_xml, "Size", "Length")
+
+
+class AddedLater(CountingMigrator):
+    name = "Rename Width to Breadth"
+    description = "Test migrator that was added after a file was exported"
+    changed_in_freecad_version = Version("1.1")
+    changed_on_date = date(2025, 2, 1)
+    changed_in_hash = "def"
+
+    def forward(self, document_xml, gui_document_xml):
+        self.runs.append((self.name, "forward"))
+        Migrator.rename_property(document_xml, "Width", "Breadth")
+
+
+@mock.patch("freecad.fcstdmigrator.migrate.find_migrator_subclasses")
+class TestProvenance(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self.tmpdir.name)
+        self.source = self.root / "source.FCStd"
+        with zipfile.ZipFile(self.source, "w") as z:
+            z.writestr(
+                "Document.xml",
+                '<Document ProgramVersion="1.0"><Property name="Length"/>'
+                '<Property name="Width"/></Document>',
+            )
+            z.writestr("GuiDocument.xml", '<GuiDocument ProgramVersion="1.0"/>')
+        CountingMigrator.runs.clear()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def export(self, source, version):
+        output = self.root / f"{source.stem}-{version}.FCStd"
+        Migrate(str(source), Version(version)).export(str(output))
+        return output
+
+    def test_export_records_provenance(self, mock_find):
+        mock_find.return_value = [CountingMigrator]
+        output = self.export(self.source, "1.1")
+        with zipfile.ZipFile(output, "r") as z:
+            recorded = json.loads(z.read(PROVENANCE_MEMBER))
+            provenance = read_provenance(z)
+        self.assertEqual(recorded["source_version"], "1.0")
+        self.assertEqual(recorded["target_version"], "1.1")
+        self.assertEqual(
+            recorded["applied"],
+            [
+                {
+                    "name": "Rename Length to Size",
+                    "changed_in_hash": "abc",
+                    "changed_on_date": "2025-01-01",
+                    "direction": "forward",
+                }
+            ],
+        )
+        self.assertEqual(provenance.source_version, Version("1.0"))
+
+    def test_only_missing_migrators_are_applied(self, mock_find):
+        mock_find.return_value = [CountingMigrator]
+        output = self.export(self.source, "1.1")
+        with zipfile.ZipFile(output, "r") as z:
+            self.assertTrue(is_up_to_date(z, Version("1.1"), [CountingMigrator]))
+            self.assertFalse(is_up_to_date(z, Version("1.1"), [CountingMigrator, AddedLater]))
+            self.assertEqual(
+                missing_migrators(read_provenance(z), [CountingMigrator, AddedLater]),
+                ("forward", [AddedLater]),
+            )
+
+        CountingMigrator.runs.clear()
+        mock_find.return_value = [CountingMigrator, AddedLater]
+        migration = Migrate(str(output), Version("1.1"))
+        self.assertEqual(CountingMigrator.runs, [("Rename Width to Breadth", "forward")])
+        names = [prop.get("name") for prop in migration.document_xml.iter("Property")]
+        self.assertEqual(names, ["Size", "Breadth"])
+
+        remigrated = self.export(output, "1.1")
+        with zipfile.ZipFile(remigrated, "r") as z:
+            self.assertTrue(is_up_to_date(z, Version("1.1"), [CountingMigrator, AddedLater]))
+            self.assertEqual(read_provenance(z).source_version, Version("1.0"))
+
+    def test_migrating_back_cancels_out(self, mock_find):
+        mock_find.return_value = [CountingMigrator]
+        migration = Migrate(str(self.source), Version("1.1"))
+        migration.migrate_to(Version("1.0"))
+        self.assertEqual(migration.applied, [])
+
+    def test_modified_file_has_no_provenance(self, mock_find):
+        mock_find.return_value = [CountingMigrator]
+        output = self.export(self.source, "1.1")
+        modified = self.root / "modified.FCStd"
+        with zipfile.ZipFile(output, "r") as z, zipfile.ZipFile(modified, "w") as m:
+            for name in z.namelist():
+                data = z.read(name)
+                if name == "Document.xml":
+                    data = data.replace(b"Size", b"Length")
+                m.writestr(name, data)
+        with zipfile.ZipFile(modified, "r") as z:
+            self.assertIsNone(read_provenance(z))
+            self.assertFalse(is_up_to_date(z, Version("1.1"), [CountingMigrator]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+
+import os
+import unittest
+import tempfile
+import zipfile
+
+from freecad.fcstdmigrator.sharding import (
+    Manifest,
+    ManifestEntry,
+    merge_manifests,
+    parse_shard,
+    read_manifest,
+    shard_by_path,
+    shard_by_size,
+    uncompressed_size,
+    write_manifest,
+)
+
+
+class TestPartitioning(unittest.TestCase):
+    def setUp(self):
+        self.paths = [f"dir{i % 3}/part{i}.FCStd" for i in range(50)]
+
+    def test_parse_shard(self):
+        self.assertEqual(parse_shard("2/4"), (2, 4))
+        for value in ("0/4", "5/4", "1", "a/b"):
+            with self.assertRaises(ValueError):
+                parse_shard(value)
+
+    def test_path_shards_are_disjoint_and_complete(self):
+        shards = [shard_by_path(self.paths, index, 4) for index in range(1, 5)]
+        self.assertEqual(sorted(path for shard in shards for path in shard), sorted(self.paths))
+        self.assertTrue(all(shards))
+
+    def test_path_shards_are_stable(self):
+        shard = shard_by_path(self.paths, 2, 4)
+        self.assertEqual(shard_by_path(list(reversed(self.paths)), 2, 4), list(reversed(shard)))
+        more = shard_by_path(self.paths + ["new.FCStd"], 2, 4)
+        self.assertEqual([path for path in more if path != "new.FCStd"], shard)
+
+    def test_size_shards_are_balanced(self):
+        sizes = {path: (i * 7919) % 1000 + 1 for i, path in enumerate(self.paths)}
+        shards = [shard_by_size(sizes, index, 3) for index in range(1, 4)]
+        self.assertEqual(sorted(path for shard in shards for path in shard), sorted(self.paths))
+        totals = [sum(sizes[path] for path in shard) for shard in shards]
+        self.assertLessEqual(max(totals) - min(totals), max(sizes.values()))
+        self.assertEqual(shard_by_size(dict(reversed(list(sizes.items()))), 2, 3), shards[1])
+
+    def test_uncompressed_size(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            archive = os.path.join(tmpdir, "a.FCStd")
+            with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as z:
+                z.writestr("Document.xml", "x" * 1000)
+                z.writestr("Shape.brp", "y" * 500)
+            self.assertEqual(uncompressed_size(archive), 1500)
+            broken = os.path.join(tmpdir, "b.FCStd")
+            with open(broken, "wb") as f:
+                f.write(b"not a zip")
+            self.assertEqual(uncompressed_size(broken), 9)
+
+
+class TestManifests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_round_trip_and_merge(self):
+        manifests = [
+            Manifest(1, 3, "1.1", 2.0, [ManifestEntry("b.FCStd"), ManifestEntry("d.FCStd")]),
+            Manifest(3, 3, "1.1", 5.0, [ManifestEntry("a.FCStd", "ValueError: bad", False)]),
+        ]
+        filenames = []
+        for manifest in manifests:
+            filenames.append(os.path.join(self.tmpdir.name, f"shard{manifest.shard}.json"))
+            write_manifest(filenames[-1], manifest)
+
+        report = merge_manifests([read_manifest(filename) for filename in filenames])
+        self.assertEqual(
+            [entry.path for entry in report.entries], ["a.FCStd", "b.FCStd", "d.FCStd"]
+        )
+        self.assertEqual(report.missing_shards, [2])
+        self.assertEqual(report.elapsed, 5.0)
+        summary = report.summary()
+        self.assertIn("Migrated 2 of 3 file(s) in 2 of 3 shard(s)", summary)
+        self.assertIn("Missing manifests for shard(s) 2", summary)
+
+    def test_manifests_must_come_from_one_run(self):
+        first = Manifest(1, 2, "1.1", 1.0, [])
+        with self.assertRaises(ValueError):
+            merge_manifests([first, Manifest(2, 2, "1.0", 1.0, [])])
+        with self.assertRaises(ValueError):
+            merge_manifests([first, first])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,132 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+
+import unittest
+from unittest import mock
+import tempfile
+import zipfile
+import pathlib
+from datetime import date
+from xml.etree.ElementTree import fromstring
+from packaging.version import Version
+
+from in_process import executor_in_process
+
+from freecad.fcstdmigrator.migrator import Migrator
+from freecad.fcstdmigrator.verify import (
+    find_mismatches,
+    subtree_hashes,
+    verify_corpus,
+    verify_roundtrip,
+)
+
+DOCUMENT_XML = """<Document ProgramVersion="1.0">
+    <ObjectData Count="2">
+        <Object name="Box">
+            <Properties Count="1">
+                <Property name="AttachmentSupport" type="App::PropertyLinkSubList"/>
+            </Properties>
+        </Object>
+        <Object name="Cylinder">
+            <Properties Count="1">
+                <Property name="Radius" type="App::PropertyLength"><Float value="2"/></Property>
+            </Properties>
+        </Object>
+    </ObjectData>
+</Document>"""
+
+
+class RenameRadius(Migrator):
+    name = "Rename radius"
+    description = "Test migrator that round-trips cleanly"
+    changed_in_freecad_version = Version("1.1")
+    changed_on_date = date(2025, 1, 1)
+    changed_in_hash = "abc"
+
+    def forward(self, document_xml, gui_document_xml):
+        Migrator.rename_property(document_xml, "Radius", "R")
+
+    def backward(self, document_xml, gui_document_xml):
+        Migrator.rename_property(document_xml, "R", "Radius")
+
+
+class LossyRename(RenameRadius):
+    name = "Lossy rename"
+    description = "Test migrator that does not round-trip"
+    changed_in_freecad_version = Version("1.1")
+    changed_on_date = date(2025, 1, 2)
+    changed_in_hash = "def"
+
+    def backward(self, document_xml, gui_document_xml):
+        Migrator.rename_property(document_xml, "R", "Diameter")
+
+
+class TestSubtreeHashes(unittest.TestCase):
+    def test_formatting_and_attribute_order_do_not_matter(self):
+        a = fromstring('<A x="1" y="2">\n  <B>text</B>\n</A>')
+        b = fromstring('<A y="2" x="1"><B> text </B></A>')
+        self.assertEqual(subtree_hashes(a)[a], subtree_hashes(b)[b])
+
+    def test_child_changes_change_parent_hash(self):
+        a = fromstring('<A><B v="1"/></A>')
+        b = fromstring('<A><B v="2"/></A>')
+        self.assertNotEqual(subtree_hashes(a)[a], subtree_hashes(b)[b])
+
+
+class TestFindMismatches(unittest.TestCase):
+    def test_identical_trees_have_no_mismatches(self):
+        self.assertEqual(
+            find_mismatches("Document.xml", fromstring(DOCUMENT_XML), fromstring(DOCUMENT_XML)), []
+        )
+
+    def test_mismatch_reports_path(self):
+        original = fromstring(DOCUMENT_XML)
+        other = fromstring(DOCUMENT_XML.replace('name="Radius"', 'name="Diameter"'))
+        mismatches = find_mismatches("Document.xml", original, other)
+        self.assertEqual(len(mismatches), 1)
+        self.assertEqual(
+            mismatches[0].path,
+            "Document/ObjectData/Object[Cylinder]/Properties/Property[Radius]",
+        )
+        self.assertIn("'name'", mismatches[0].reason)
+
+    def test_structural_mismatch(self):
+        original = fromstring("<A><B/><C/></A>")
+        other = fromstring("<A><B/></A>")
+        mismatches = find_mismatches("Document.xml", original, other)
+        self.assertEqual(len(mismatches), 1)
+        self.assertIn("2 child elements became 1", mismatches[0].reason)
+
+
+class TestVerifyRoundtrip(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.freecad_file = pathlib.Path(self.tmpdir.name) / "test.FCStd"
+        with zipfile.ZipFile(self.freecad_file, "w") as z:
+            z.writestr("Document.xml", DOCUMENT_XML)
+            z.writestr("GuiDocument.xml", '<GuiDocument ProgramVersion="1.0"/>')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    @mock.patch("freecad.fcstdmigrator.migrate.find_migrator_subclasses")
+    def test_clean_roundtrip(self, mock_find):
+        mock_find.return_value = [RenameRadius]
+        self.assertEqual(verify_roundtrip(str(self.freecad_file), Version("1.1")), [])
+
+    @mock.patch("freecad.fcstdmigrator.migrate.find_migrator_subclasses")
+    def test_lossy_roundtrip(self, mock_find):
+        mock_find.return_value = [LossyRename]
+        mismatches = verify_roundtrip(str(self.freecad_file), Version("1.1"))
+        self.assertEqual(len(mismatches), 1)
+        self.assertEqual(mismatches[0].document, "Document.xml")
+        self.assertIn("Object[Cylinder]", mismatches[0].path)
+
+    @mock.patch("freecad.fcstdmigrator.migrate.find_migrator_subclasses")
+    def test_verify_corpus_reports_errors_per_file(self, mock_find):
+        mock_find.return_value = [RenameRadius]
+        missing = str(pathlib.Path(self.tmpdir.name) / "missing.FCStd")
+        with executor_in_process("freecad.fcstdmigrator.verify"):
+            results = verify_corpus([str(self.freecad_file), missing], Version("1.1"))
+        self.assertTrue(results[0].ok)
+        self.assertFalse(results[1].ok)
+        self.assertIsNotNone(results[1].error)
@@ -1,9 +1,13 @@
 # SPDX-License-Identifier: LGPL-2.1-or-later
 
 from unittest import TestCase
-from xml.etree.ElementTree import Element
+from xml.etree.ElementTree import Element, fromstring
 
-from freecad.fcstdmigrator.xml_utilities import find_elements_by_type, find_first_element_with_name
+from freecad.fcstdmigrator.xml_utilities import (
+    find_color_list_files,
+    find_elements_by_type,
+    find_first_element_with_name,
+)
 
 
 class TestFindElementsByType(TestCase):
@@ -100,3 +104,20 @@ class TestFindFirstElementWithName(TestCase):
         root.append(Element("child", attrib={"Name":"foo"}))
         result = find_first_element_with_name(root, "bar")
         self.assertIsNone(result)
+
+
+class TestFindColorListFiles(TestCase):
+
+    def test_finds_referenced_members(self):
+        root = fromstring(
+            '<GuiDocument><ViewProviderData>'
+            '<ViewProvider name="Wall"><Properties>'
+            '<Property name="DiffuseColor" type="App::PropertyColorList">'
+            '<ColorList file="DiffuseColor"/></Property>'
+            '<Property name="LineColorArray" type="App::PropertyColorList">'
+            '<ColorList file="LineColorArray1"/></Property>'
+            '<Property name="ShapeColor" type="App::PropertyColor"><PropertyColor value="1"/>'
+            '</Property></Properties></ViewProvider>'
+            '</ViewProviderData></GuiDocument>'
+        )
+        self.assertEqual(find_color_list_files(root), ["DiffuseColor", "LineColorArray1"])
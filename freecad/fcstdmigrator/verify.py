@@ -0,0 +1,131 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+
+# Round-trip verification of migrations: a file is migrated to a target version and back again
+# in memory, and the result is compared with the original. Comparison is done on canonical
+# (Merkle-style) subtree hashes, so identical subtrees are skipped without being walked, and
+# mismatches are reported with the path of the element where they occur.
+
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, NamedTuple, Optional
+from xml.etree.ElementTree import Element
+
+from packaging.version import Version
+
+from .migrate import Migrate
+
+
+class Mismatch(NamedTuple):
+    document: str
+    path: str
+    reason: str
+
+
+class VerificationResult(NamedTuple):
+    freecad_file: str
+    mismatches: List[Mismatch]
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and not self.mismatches
+
+
+def subtree_hashes(root: Element) -> Dict[Element, bytes]:
+    """Compute a canonical hash of every subtree of root (including root itself) in a single
+    post-order pass. The hash of an element covers its tag, its attributes (in sorted order), its
+    whitespace-stripped text, and the hashes of its children in document order. Formatting-only
+    whitespace between elements is ignored."""
+    hashes = {}
+
+    def recurse(node: Element) -> bytes:
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(node.tag.encode("utf-8"))
+        for key in sorted(node.attrib):
+            digest.update(f"\0{key}\1{node.attrib[key]}".encode("utf-8"))
+        digest.update(b"\2")
+        digest.update((node.text or "").strip().encode("utf-8"))
+        for child in node:
+            digest.update(b"\3")
+            digest.update(recurse(child))
+        hashes[node] = digest.digest()
+        return hashes[node]
+
+    recurse(root)
+    return hashes
+
+
+def _path_segment(element: Element) -> str:
+    name = element.get("name", element.get("Name"))
+    return element.tag if name is None else f"{element.tag}[{name}]"
+
+
+def _describe_difference(original: Element, other: Element) -> Optional[str]:
+    """Describe how the two elements themselves (ignoring their children) differ, or return None
+    if they do not."""
+    if original.tag != other.tag:
+        return f"tag {original.tag!r} became {other.tag!r}"
+    for key in sorted(set(original.attrib) | set(other.attrib)):
+        if original.get(key) != other.get(key):
+            return f"attribute {key!r} {original.get(key)!r} became {other.get(key)!r}"
+    if (original.text or "").strip() != (other.text or "").strip():
+        return f"text {original.text!r} became {other.text!r}"
+    return None
+
+
+def find_mismatches(document: str, original: Element, other: Element) -> List[Mismatch]:
+    """Compare two element trees, descending only into subtrees whose hashes differ."""
+    original_hashes = subtree_hashes(original)
+    other_hashes = subtree_hashes(other)
+    mismatches = []
+
+    def recurse(a: Element, b: Element, parent_path: str):
+        if original_hashes[a] == other_hashes[b]:
+            return
+        path = f"{parent_path}/{_path_segment(a)}" if parent_path else _path_segment(a)
+        difference = _describe_difference(a, b)
+        if difference is not None:
+            mismatches.append(Mismatch(document, path, difference))
+        if len(a) != len(b):
+            mismatches.append(Mismatch(document, path, f"{len(a)} child elements became {len(b)}"))
+            return
+        for child_a, child_b in zip(a, b):
+            recurse(child_a, child_b, path)
+
+    recurse(original, other, "")
+    return mismatches
+
+
+def verify_roundtrip(freecad_file: str, target_version: Version) -> List[Mismatch]:
+    """Migrate the file to target_version and back to its original version, in memory, and return
+    every difference between the result and the original file. An empty list means the migration
+    round-trips cleanly."""
+    migration = Migrate(freecad_file, target_version, apply_delta=False)
+    migration.migrate_to(migration.original_version)
+
+    mismatches = []
+    for xml_file_name, roundtripped in (
+        ("Document.xml", migration.document_xml),
+        ("GuiDocument.xml", migration.gui_document_xml),
+    ):
+        original = migration.load_xml(xml_file_name)
+        mismatches.extend(find_mismatches(xml_file_name, original, roundtripped))
+    return mismatches
+
+
+def _verify_file(freecad_file: str, target_version: Version) -> VerificationResult:
+    try:
+        return VerificationResult(freecad_file, verify_roundtrip(freecad_file, target_version))
+    except Exception as e:
+        return VerificationResult(freecad_file, [], f"{type(e).__name__}: {e}")
+
+
+def verify_corpus(
+    freecad_files: List[str], target_version: Version, jobs: Optional[int] = None
+) -> List[VerificationResult]:
+    """Round-trip verify many files in parallel, using up to jobs worker processes (defaults to the
+    number of CPUs). Errors are reported per-file rather than aborting the run."""
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        return list(
+            executor.map(_verify_file, freecad_files, [target_version] * len(freecad_files))
+        )
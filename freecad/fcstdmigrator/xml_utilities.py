@@ -28,4 +28,28 @@ def find_first_element_with_name(root: Element, target_name: str) -> Optional[El
                 return result
         return None
 
-    return recurse(root)
\ No newline at end of file
+    return recurse(root)
+
+
+def find_objects_with_property_type(root: Element, target_type: str) -> List[str]:
+    """Find the names of the objects (Object elements in Document.xml, ViewProvider elements in
+    GuiDocument.xml) that have a property of the given type."""
+    names = []
+    for tag in ("Object", "ViewProvider"):
+        for obj in root.iter(tag):
+            if obj.get("name") is None:
+                continue
+            if any(prop.get("type") == target_type for prop in obj.iter("Property")):
+                names.append(obj.get("name"))
+    return names
+
+
+def find_color_list_files(root: Element) -> List[str]:
+    """Find the names of the archive members holding the values of the App::PropertyColorList
+    properties below root (the "file" attribute of their ColorList element)."""
+    names = []
+    for prop in find_elements_by_type(root, "App::PropertyColorList"):
+        color_list = prop.find("ColorList")
+        if color_list is not None and color_list.get("file"):
+            names.append(color_list.get("file"))
+    return names